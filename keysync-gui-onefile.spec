@@ -1,7 +1,10 @@
 # -*- mode: python -*-
+import sys
+sys.path.insert(0, SPECPATH) # so otrapps is found
+import otrapps
 a = Analysis(['keysync-gui'],
              pathex=['c:\\Users\\abel\\Documents\\keysync'],
-             hiddenimports=[],
+             hiddenimports=otrapps.app_modules(),
              hookspath=None,
              runtime_hooks=None)
 pyz = PYZ(a.pure)
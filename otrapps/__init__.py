@@ -1,46 +1,103 @@
 
 '''sets up the otrapps module with all of the currently supported apps'''
 
+import importlib
 import os
 import sys
+import types
 
-from pkg_resources import get_distribution, DistributionNotFound
 try:
-    _dist = get_distribution('keysync')
-    if not __file__.startswith(os.path.join(_dist.location, 'otrapps')):
-        raise DistributionNotFound
-except DistributionNotFound:
-    # probably running from source repo or another version is installed
-    __version__ = '(local version)'
-else:
-    __version__ = _dist.version
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping # python < 3.3
+
+
+_version = None
+
+def get_version():
+    '''look up the installed version, pkg_resources is slow so only on demand'''
+    global _version
+    if _version is None:
+        from pkg_resources import get_distribution, DistributionNotFound
+        try:
+            _dist = get_distribution('keysync')
+            if not __file__.startswith(os.path.join(_dist.location, 'otrapps')):
+                raise DistributionNotFound
+        except DistributionNotFound:
+            # probably running from source repo or another version is installed
+            _version = '(local version)'
+        else:
+            _version = _dist.version
+    return _version
+
+
+class _OtrappsModule(types.ModuleType):
+    '''
+    Stands in for this module in sys.modules, so that __version__ is only
+    looked up when it is used.  A module __getattr__ would need python 3.7.
+    '''
+
+    @property
+    def __version__(self):
+        return get_version()
 
 
 __all__ = ['adium', 'chatsecure', 'irssi', 'jitsi', 'pidgin', 'gajim', 'gnupg', 'xchat', 'kopete',]
 
 if __name__ == '__main__':
     sys.path.insert(0, "../") # so the main() test suite can find otrapps module
-import otrapps.adium
-import otrapps.chatsecure
-import otrapps.irssi
-import otrapps.jitsi
-import otrapps.pidgin
-import otrapps.gajim
-import otrapps.gnupg
-import otrapps.xchat
-import otrapps.kopete
-
-apps = { 'adium'     : otrapps.adium.AdiumProperties,
-         'chatsecure': otrapps.chatsecure.ChatSecureProperties,
-         'irssi'     : otrapps.irssi.IrssiProperties,
-         'jitsi'     : otrapps.jitsi.JitsiProperties,
-         'pidgin'    : otrapps.pidgin.PidginProperties,
-         'gajim'     : otrapps.gajim.GajimProperties,
-         'gnupg'     : otrapps.gnupg.GnuPGProperties,
-         'xchat'     : otrapps.xchat.XchatProperties,
-         'kopete'    : otrapps.kopete.KopeteProperties,
-        }
-apps_supported = apps.keys()
+
+
+class AppRegistry(Mapping):
+    '''
+    Maps app names to their *Properties classes.  Each app module pulls in
+    its own heavy dependencies (BeautifulSoup, pyparsing, potr, pgpdump,
+    etc.), so a module is only imported the first time its app is looked up.
+    '''
+
+    def __init__(self, classnames):
+        self._classnames = classnames
+        self._classes = dict()
+
+    def modulename(self, app):
+        '''the name of the module that app's class is in'''
+        return self._classnames[app].rsplit('.', 1)[0]
+
+    def __getitem__(self, app):
+        if app not in self._classes:
+            classname = self._classnames[app].rsplit('.', 1)[1]
+            module = importlib.import_module(self.modulename(app))
+            self._classes[app] = getattr(module, classname)
+        return self._classes[app]
+
+    def __iter__(self):
+        return iter(self._classnames)
+
+    def __len__(self):
+        return len(self._classnames)
+
+    def __contains__(self, app):
+        return app in self._classnames
+
+
+apps = AppRegistry({ 'adium'     : 'otrapps.adium.AdiumProperties',
+                     'chatsecure': 'otrapps.chatsecure.ChatSecureProperties',
+                     'irssi'     : 'otrapps.irssi.IrssiProperties',
+                     'jitsi'     : 'otrapps.jitsi.JitsiProperties',
+                     'pidgin'    : 'otrapps.pidgin.PidginProperties',
+                     'gajim'     : 'otrapps.gajim.GajimProperties',
+                     'gnupg'     : 'otrapps.gnupg.GnuPGProperties',
+                     'xchat'     : 'otrapps.xchat.XchatProperties',
+                     'kopete'    : 'otrapps.kopete.KopeteProperties',
+                    })
+apps_supported = list(apps.keys())
+
+def app_modules():
+    '''
+    the module of each app, for the app bundlers, which cannot find them on
+    their own since apps only imports them by name
+    '''
+    return sorted(set(apps.modulename(app) for app in apps))
 
 def make_outdir(output_folder, subdir):
     '''create the folder that the results will be written to'''
@@ -50,3 +107,7 @@ def make_outdir(output_folder, subdir):
     return outdir
 
 
+if __name__ != '__main__':
+    _module = sys.modules[__name__] # its functions still use its globals
+    sys.modules[__name__] = _OtrappsModule(__name__, __doc__)
+    sys.modules[__name__].__dict__.update(_module.__dict__)
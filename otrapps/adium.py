@@ -4,11 +4,11 @@
 from __future__ import print_function
 import os
 import platform
-import plistlib
 import sys
 
 if __name__ == '__main__':
     sys.path.insert(0, "../") # so the main() test suite can find otrapps module
+import otrapps.plist
 import otrapps.util
 from otrapps.otr_private_key import OtrPrivateKeys
 from otrapps.otr_fingerprints import OtrFingerprints
@@ -37,11 +37,25 @@ class AdiumProperties():
             else:
                 print('Adium ERROR: No usable Accounts.plist file found, cannot create Adium files!')
                 return []
-        # make sure the plist is in XML format, not binary,
-        # this should be converted to use python-biplist.
-        if platform.system() == 'Darwin':
-            os.system("plutil -convert xml1 '" + accountsfile + "'")
-        return plistlib.readPlist(accountsfile)['Accounts']
+        # Adium might have saved it as XML or binary, both are read as is,
+        # so there is no need to convert Adium's own file with plutil
+        return otrapps.plist.read(accountsfile).get('Accounts', [])
+
+    @staticmethod
+    def _get_account_maps(settingsdir):
+        '''
+        Read the accounts once, returning them along with the maps from
+        Adium's account index number (ObjectID) to the account name (UID)
+        and back, so each key is a single lookup.
+        '''
+        accounts = AdiumProperties._get_accounts_from_plist(settingsdir)
+        objectid_to_uid = dict()
+        uid_to_objectid = dict()
+        for account in accounts:
+            objectid = str(account['ObjectID'])
+            objectid_to_uid[objectid] = account['UID']
+            uid_to_objectid[account['UID']] = objectid
+        return accounts, objectid_to_uid, uid_to_objectid
 
     @staticmethod
     def parse(settingsdir=None):
@@ -54,14 +68,13 @@ class AdiumProperties():
         else:
             keydict = dict()
 
-        accounts = AdiumProperties._get_accounts_from_plist(settingsdir)
+        objectid_to_uid = AdiumProperties._get_account_maps(settingsdir)[1]
         newkeydict = dict()
-        for adiumIndex, key in keydict.items():
-            for account in accounts:
-                if account['ObjectID'] == key['name']:
-                    name = account['UID']
-                    key['name'] = name
-                    newkeydict[name] = key
+        for key in keydict.values():
+            name = objectid_to_uid.get(key['name'])
+            if name is not None:
+                key['name'] = name
+                newkeydict[name] = key
         keydict = newkeydict
 
         fpf = os.path.join(settingsdir, AdiumProperties.fingerprintfile)
@@ -76,21 +89,14 @@ class AdiumProperties():
             raise Exception('"' + savedir + '" does not exist!')
 
         # need when converting account names back to Adium's account index number
-        accountsplist = AdiumProperties._get_accounts_from_plist(savedir)
+        accountsplist, objectid_to_uid, uid_to_objectid = \
+            AdiumProperties._get_account_maps(savedir)
+        keydict = otrapps.util.KeydictView(keydict, name=uid_to_objectid)
 
         kf = os.path.join(savedir, AdiumProperties.keyfile)
-        adiumkeydict = dict()
-        for name, key in keydict.items():
-            name = key['name']
-            for account in accountsplist:
-                if account['UID'] == name:
-                    key['name'] = account['ObjectID']
-                    adiumkeydict[name] = key
         OtrPrivateKeys.write(keydict, kf)
 
-        accounts = []
-        for account in accountsplist:
-            accounts.append(account['ObjectID'])
+        accounts = [str(account['ObjectID']) for account in accountsplist]
         fpf = os.path.join(savedir, AdiumProperties.fingerprintfile)
         OtrFingerprints.write(keydict, fpf, accounts)
 
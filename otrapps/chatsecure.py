@@ -12,6 +12,7 @@ import tempfile
 
 if __name__ == '__main__':
     sys.path.insert(0, "../") # so the main() test suite can find otrapps module
+import otrapps.stages as stages
 import otrapps.util
 
 class ChatSecureProperties():
@@ -30,7 +31,8 @@ class ChatSecureProperties():
         # multiple properties are combined into a single keydict per account,
         # containing all of the fields
         p = pyjavaproperties.Properties()
-        p.load(open(filename))
+        with stages.stage('read'):
+            p.load(open(filename))
         parsed = []
         for item in p.items():
             propkey = item[0]
@@ -72,8 +74,48 @@ class ChatSecureProperties():
         return keydict
 
     @staticmethod
-    def write(keydict, savedir, password=None):
-        '''given a keydict, generate a chatsecure file in the savedir'''
+    def _cache_digest(p):
+        '''a digest of exactly what goes into the keystore'''
+        h = hashlib.sha256()
+        for propkey, value in sorted(p.items()):
+            h.update((propkey + '=' + value + '\n').encode('utf-8'))
+        return h.hexdigest()
+
+    @staticmethod
+    def _read_cache(cachedir, digest, password):
+        '''the cached encrypted keystore and password, if they are for digest'''
+        filenames = [os.path.join(cachedir, f) for f in ('digest', 'password',
+                                                         ChatSecureProperties.encryptedkeyfile)]
+        for filename in filenames:
+            if not os.path.exists(filename):
+                return None
+        with open(filenames[0]) as f:
+            if f.read().strip() != digest:
+                return None
+        with open(filenames[1]) as f:
+            cachedpassword = f.read()
+        if password and password != cachedpassword:
+            return None
+        with open(filenames[2], 'rb') as f:
+            return f.read(), cachedpassword
+
+    @staticmethod
+    def _write_cache(cachedir, digest, password, encrypted):
+        # the keystore last, so a partial write never matches the digest
+        otrapps.util.write_private_file(os.path.join(cachedir, 'digest'), '')
+        otrapps.util.write_private_file(os.path.join(cachedir, 'password'), password)
+        otrapps.util.write_private_file(os.path.join(cachedir, ChatSecureProperties.encryptedkeyfile),
+                                        encrypted)
+        otrapps.util.write_private_file(os.path.join(cachedir, 'digest'), digest)
+
+    @staticmethod
+    def write(keydict, savedir, password=None, cachedir=None):
+        '''
+        Given a keydict, generate a chatsecure file in the savedir.  With a
+        cachedir, the last keystore and its password are reused as long as
+        the keys in it have not changed, so there is nothing new to scan.
+        '''
+        requested_password = password
         p = pyjavaproperties.Properties()
         for name, key in keydict.items():
             # only include XMPP keys, since ChatSecure only supports XMPP
@@ -90,9 +132,22 @@ class ChatSecureProperties():
                     p.setProperty(key['name'] + '.privateKey', otrapps.util.ExportDsaPkcs8(key))
             if 'fingerprint' in key:
                 p.setProperty(key['name'] + '.fingerprint', key['fingerprint'])
-            if 'verification' in key and key['verification'] != None:
+            # libotr marks unverified fingerprints with '', and the flag is
+            # stored by fingerprint, so Jitsi's flag for a buddy without a
+            # public key cannot be kept
+            if key.get('verification') and 'fingerprint' in key:
                 p.setProperty(key['name'] + '.' + key['fingerprint'].lower()
                               + '.publicKey.verified', 'true')
+        keystore = os.path.join(savedir, ChatSecureProperties.encryptedkeyfile)
+        if cachedir:
+            digest = ChatSecureProperties._cache_digest(p)
+            cached = ChatSecureProperties._read_cache(cachedir, digest, requested_password)
+            if cached:
+                encrypted, ChatSecureProperties.password = cached
+                print('ChatSecure: the keys have not changed, reusing the cached keystore')
+                otrapps.util.save_output(keystore, encrypted, binary=True)
+                return
+
         fd, filename = tempfile.mkstemp()
         f = os.fdopen(fd, 'w')
         p.store(f)
@@ -106,12 +161,21 @@ class ChatSecureProperties():
             password = os.urandom(32).encode('base64')
 
         # create passphrase file from the first private key
+        fd, encrypted = tempfile.mkstemp()
+        os.close(fd)
         cmd = ['openssl', 'aes-256-cbc', '-pass', 'stdin', '-in', filename,
-               '-out', os.path.join(savedir, 'otr_keystore.ofcaes')]
-        p = subprocess.Popen(cmd, stdin=subprocess.PIPE,
-                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        ChatSecureProperties.password = password
-        print((p.communicate(password)))
+               '-out', encrypted]
+        with stages.stage('encrypt'):
+            p = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            ChatSecureProperties.password = password
+            print((p.communicate(password)))
+        with open(encrypted, 'rb') as f:
+            data = f.read()
+        os.remove(encrypted)
+        otrapps.util.save_output(keystore, data, binary=True)
+        if cachedir and not otrapps.util.dry_run:
+            ChatSecureProperties._write_cache(cachedir, digest, password, data)
 
     @staticmethod
     def _decrypt_ofcaes(ofcaes_filename, password):
@@ -126,9 +190,10 @@ class ChatSecureProperties():
         # same as above, but with the -d flag to decrypt
         cmd = ['openssl', 'aes-256-cbc', '-d', '-pass', 'stdin', '-in', ofcaes_filename,
        '-out', filename]
-        p = subprocess.Popen(cmd, stdin=subprocess.PIPE,
-                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        p.communicate(password)
+        with stages.stage('decrypt'):
+            p = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            p.communicate(password)
         return filename
 
 
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''a module for noticing when an Android device is attached for syncing'''
+
+from __future__ import print_function
+import functools
+import os
+import sys
+import threading
+import time
+
+if __name__ == '__main__':
+    sys.path.insert(0, "../") # so the main() test suite can find otrapps module
+import otrapps.util
+
+
+class DeviceMonitor():
+    '''
+    Keeps track of whether there is a device to sync to, and tells the
+    subscribers when one is attached or detached.  Checking the gvfs mounts
+    is only a stat() of the folders they are in unless something there
+    changed, and the slow pymtp probe is backed off exponentially while
+    nothing is found.  Every device that gvfs mounted is in destdirs.
+    Call poll() regularly, i.e. from a GUI timer, or wait() from the CLI.
+    '''
+
+    def __init__(self, min_probe_interval=3.0, max_probe_interval=60.0):
+        self.min_probe_interval = min_probe_interval
+        self.max_probe_interval = max_probe_interval
+        self.attached = None # unknown until the first poll()
+        self.devicename = ''
+        self.destdir = None
+        self.destdirs = []
+        self._subscribers = []
+        self._mtp_found = False
+        self._mount_state = None
+        self._probe_interval = min_probe_interval
+        self._next_probe = 0
+        self._connect_thread = None
+        self._connected = False
+        self._connect_error = None
+
+    def subscribe(self, callback):
+        '''callback(event, monitor) gets 'attached' or 'detached' events'''
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def _emit(self, event):
+        for callback in list(self._subscribers):
+            callback(event, self)
+
+    def _check_gvfs(self):
+        '''re-resolve the gvfs destinations only when the mount folders change'''
+        state = []
+        for gvfsdir in otrapps.util.gvfs_dirs():
+            try:
+                state.append(os.stat(gvfsdir).st_mtime)
+            except OSError:
+                state.append(None)
+        if not [mtime for mtime in state if mtime is not None]:
+            self._mount_state = None
+            self.destdirs = []
+            self.destdir = None
+            return None
+        if state != self._mount_state \
+                or [d for d in self.destdirs if not os.path.isdir(d)]:
+            self._mount_state = state
+            self.destdirs = otrapps.util.find_gvfs_destdirs()
+            self.destdir = self.destdirs[0] if self.destdirs else None
+        return self.destdir
+
+    def _probe_mtp(self):
+        '''run the slow pymtp probe, backing off while nothing is found'''
+        now = time.time()
+        if now < self._next_probe:
+            return self._mtp_found
+        found = False
+        try:
+            devices = otrapps.util.get_mtp().detect_devices()
+            if len(devices) > 0:
+                e = devices[0].device_entry
+                self.devicename = e.vendor + ' ' + e.product
+                found = True
+        except Exception as e:
+            print('except ' + str(e))
+        if found:
+            self._probe_interval = self.min_probe_interval
+        else:
+            self._probe_interval = min(self._probe_interval * 2,
+                                       self.max_probe_interval)
+        self._next_probe = now + self._probe_interval
+        self._mtp_found = found
+        return found
+
+    def poll(self):
+        '''check for a device, returns True if one is ready for syncing'''
+        if sys.platform == 'win32':
+            # Right now the win32 'sync' method is to prompt the user to manually
+            # copy the file over, so we always return true.
+            # https://dev.guardianproject.info/issues/2126
+            self.devicename = 'Copy the otr_keystore.ofcaes file to your device!'
+            attached = True
+        elif self._check_gvfs():
+            # this assumes that gvfs is mounting the MTP device.  gvfs is
+            # part of GNOME, but is probably included in other systems too
+            self.devicename = ', '.join(self.destdirs)
+            attached = True
+        else:
+            # if all else fails, try pymtp. works on GNU/Linux and Mac OS X at least
+            attached = self._probe_mtp()
+
+        if attached != self.attached:
+            self.attached = attached
+            if attached:
+                self._emit('attached')
+            else:
+                self.devicename = ''
+                self._probe_interval = self.min_probe_interval
+                self._emit('detached')
+        return attached
+
+    def wait(self, timeout=None, interval=1.0):
+        '''block until a device is attached, returns False on timeout'''
+        start = time.time()
+        while not self.poll():
+            if timeout is not None and time.time() - start >= timeout:
+                return False
+            time.sleep(interval)
+        return True
+
+    def _connect(self):
+        try:
+            if self._check_gvfs():
+                return # the gvfs mount needs no connecting
+            mtp = otrapps.util.get_mtp()
+            # without pymtp, sync_file() reports that it is missing
+            if not isinstance(mtp, otrapps.util.MTPDummy):
+                mtp.connect()
+                self._connected = True
+        except Exception as e:
+            self._connect_error = e
+
+    def start_connect(self):
+        '''
+        Start finding the gvfs destination, or connecting to the device with
+        pymtp, in the background, i.e. while the keystore is being written.
+        sync_file() waits for it to finish.
+        '''
+        self._connected = False
+        self._connect_error = None
+        self._connect_thread = threading.Thread(target=self._connect)
+        self._connect_thread.daemon = True
+        self._connect_thread.start()
+
+    def _disconnect(self):
+        if self._connected:
+            self._connected = False
+            otrapps.util.get_mtp().disconnect()
+
+    def cancel_connect(self):
+        '''undo start_connect(), i.e. when there turns out to be nothing to sync'''
+        if self._connect_thread is not None:
+            self._connect_thread.join()
+            self._connect_thread = None
+            self._disconnect()
+
+    def sync_file(self, filename, callback=None):
+        '''
+        copy filename to the attached device using the cached destination,
+        returns 'sent', or 'unchanged' if the device already had it
+        '''
+        if self._connect_thread is None:
+            return otrapps.util.sync_file_to_device(filename, destdir=self.destdir,
+                                                    callback=callback)
+        self._connect_thread.join()
+        self._connect_thread = None
+        try:
+            if self._connect_error is not None:
+                raise self._connect_error
+            return otrapps.util.sync_file_to_device(filename, destdir=self.destdir,
+                                                    callback=callback,
+                                                    connected=self._connected)
+        finally:
+            self._disconnect()
+
+    def sync_file_all(self, filename, callback=None):
+        '''
+        Copy filename to every attached device at once.  callback(device,
+        sent, total, bytes_per_second) reports each device's progress.
+        Returns a list of (device, status, exception or None), where status
+        is 'sent', 'unchanged' if that device already had the same file, or
+        'failed', so one failed device does not stop the rest.  pymtp can
+        only reach the first device it finds, so without gvfs that is the
+        only one synced.
+        '''
+        if self._connect_thread is not None:
+            self._connect_thread.join()
+        if self.destdirs and not self._connected:
+            self._connect_thread = None
+            return otrapps.util.sync_file_to_devices(filename, self.destdirs, callback)
+        device_callback = None
+        if callback:
+            device_callback = functools.partial(callback, self.devicename)
+        try:
+            return [(self.devicename, self.sync_file(filename, callback=device_callback), None)]
+        except Exception as e:
+            return [(self.devicename, 'failed', e)]
+
+
+#------------------------------------------------------------------------------#
+# for testing from the command line:
+def main(argv):
+
+    def print_event(event, monitor):
+        print(event + ': ' + monitor.devicename)
+
+    monitor = DeviceMonitor()
+    monitor.subscribe(print_event)
+    if not monitor.wait(timeout=5):
+        print('No device found to sync to.')
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -19,6 +19,9 @@ if __name__ == '__main__':
 import otrapps.util
 from otrapps.otr_fingerprints import OtrFingerprints
 
+# how many accounts' files to write at once
+WRITE_THREADS = 8
+
 # the private key is stored in ~/.local/share/gajim/_SERVERNAME_.key_file
 # the fingerprints are stored in ~/.local/share/gajim/_SERVERNAME_.fpr
 # the accounts are stored in ~/.config/gajim/config
@@ -59,6 +62,19 @@ class GajimProperties():
 
         return accounts
 
+    @staticmethod
+    def get_accounts(settingsdir=None):
+        '''get the XMPP name and Resource of every Gajim account'''
+        if settingsdir is None:
+            settingsdir = GajimProperties.accounts_path
+        accounts = []
+        for account in GajimProperties._parse_account_config(settingsdir).values():
+            if 'name' in account and 'hostname' in account:
+                accounts.append({'name': account['name'] + '@' + account['hostname'],
+                                 'protocol': 'prpl-jabber',
+                                 'resource': account.get('resource', '')})
+        return accounts
+
     @staticmethod
     def parse(settingsdir=None):
         if settingsdir is None:
@@ -109,6 +125,33 @@ class GajimProperties():
 
         return keydict
 
+    @staticmethod
+    def _render_fingerprints(keys):
+        '''
+        Render the rows of the fingerprint table, which are the same for every
+        account except for the account column, so each row is kept as the
+        buddy name and the rest of the line after the account.
+        '''
+        names = []
+        tails = []
+        for fp_name, fp_key in keys.items():
+            if 'fingerprint' in fp_key and 'verification' in fp_key:
+                names.append(fp_name)
+                tails.append('\t'.join(['xmpp', fp_key['fingerprint'], fp_key['verification']]) + '\n')
+        return names, tails
+
+    @staticmethod
+    def _write_account(savedir, table, account_name, xmpp_name, key):
+        '''write the .fpr and .key3 files of one account'''
+        names, tails = table
+        column = '\t' + xmpp_name + '\t'
+        otrapps.util.save_output(os.path.join(savedir, account_name + '.fpr'),
+                                 ''.join([name + column + tail for name, tail in zip(names, tails)]))
+
+        private_key = potr.compatcrypto.DSAKey((key['y'], key['g'], key['p'], key['q'], key['x']), private=True)
+        otrapps.util.save_output(os.path.join(savedir, account_name + '.key3'),
+                                 private_key.serializePrivateKey(), binary=True)
+
     @staticmethod
     def write(keys, savedir):
         if not os.path.exists(savedir):
@@ -125,8 +168,11 @@ class GajimProperties():
                             + '" in "' + savedir + '"')
         accounts = GajimProperties._parse_account_config(accountsdir)
         
+        # every account gets the same fingerprint table, so render it once
+        table = GajimProperties._render_fingerprints(keys)
+
         # now for each account, write the fingerprints and key
-        accounts_written = set()
+        jobs = []
         for account_name in accounts:
             xmpp_name = accounts[account_name]['name'] + '@' + accounts[account_name]['hostname']
             if not xmpp_name in keys:
@@ -136,22 +182,17 @@ class GajimProperties():
             if not 'x' in key:
                 # this is not a private key, nothing to do here
                 continue
-            
-            # write fingerprints. We do this ourselves to make sure we get the right line-endings.
-            with open(os.path.join(savedir, account_name + '.fpr'), 'w') as fp_file:
-                for fp_name, fp_key in keys.items():
-                    if 'fingerprint' in fp_key and 'verification' in fp_key:
-                        row = [fp_name, xmpp_name, 'xmpp', fp_key['fingerprint'], fp_key['verification']]
-                        fp_file.write('\t'.join(row)+'\n')
-            
-            # write private key
-            private_key = potr.compatcrypto.DSAKey((key['y'], key['g'], key['p'], key['q'], key['x']), private=True)
-            with open(os.path.join(savedir, account_name + '.key3'), 'wb') as key_file:
-                key_file.write(private_key.serializePrivateKey())
-            
+            jobs.append((account_name, xmpp_name, key))
+
+        def write_account(job):
+            GajimProperties._write_account(savedir, table, *job)
+        otrapps.util.map_threads(write_account, jobs, WRITE_THREADS)
+
+        accounts_written = set()
+        for account_name, xmpp_name, key in jobs:
             print("Wrote key for Gajim:",xmpp_name)
             accounts_written.add(xmpp_name)
-        
+
         # check for unwritten keys
         for key_name in keys.keys():
             if 'x' in keys[key_name]:
@@ -48,7 +48,8 @@ class JitsiProperties():
     @staticmethod
     def _parse_account_from_propkey(settingsdir, propkey):
         '''give a Java Properties key, parse out a real account UID and
-        protocol, based on what's listed in the contacts file'''
+        protocol, based on what's listed in the contacts file, or None when
+        it is not listed there'''
         # jitsi stores the account name in the properties key, so it strips the @ out
         m = re.match('net\.java\.sip\.communicator\.plugin\.otr\.(.*)_publicKey.*', propkey)
         name_from_prop = '.'.join(m.group(1).split('_'))
@@ -60,12 +61,26 @@ class JitsiProperties():
         protocol = None
         for e in BeautifulSoup(xml).find_all('contact'):
             if re.match(name_from_prop, e['address']):
-                name = e['address']
+                name = str(e['address'])
                 protocol = JitsiProperties._convert_protocol_name(e['account-id'].split(':')[0])
                 break
-        return str(name), protocol
+        return name, protocol
 
 
+    @staticmethod
+    def get_accounts(settingsdir=None):
+        '''get the name of every Jitsi XMPP account'''
+        if settingsdir == None:
+            settingsdir = JitsiProperties.path
+        p = Properties()
+        p.load(open(os.path.join(settingsdir, JitsiProperties.propertiesfile)))
+        accounts = []
+        for propkey, value in p.items():
+            if re.match('net\.java\.sip\.communicator\.impl\.protocol\.jabber\.acc[0-9]+\.ACCOUNT_UID', propkey):
+                accounts.append({'name': JitsiProperties._parse_account_uid(value),
+                                 'protocol': 'prpl-jabber'})
+        return accounts
+
     @staticmethod
     def parse(settingsdir=None):
         if settingsdir == None:
@@ -90,6 +105,9 @@ class JitsiProperties():
                                 + re.sub('[^a-zA-Z0-9_]', '_', item[1]))
                 private_key = p.getProperty(propkey_base + '_privateKey').strip()
                 public_key = p.getProperty(propkey_base + '_publicKey').strip()
+                if not private_key or not public_key:
+                    # Jitsi has not generated an OTR key for this account yet
+                    continue
                 numdict = otrapps.util.ParsePkcs8(private_key)
                 key['x'] = numdict['x']
                 numdict = otrapps.util.ParseX509(public_key)
@@ -117,6 +135,10 @@ class JitsiProperties():
             elif (re.match('net\.java\.sip\.communicator\.plugin\.otr\..*_publicKey', propkey) and not
                   re.match('net\.java\.sip\.communicator\.plugin\.otr\.(Jabber_|Google_Talk_)', propkey)):
                 name, ignored = JitsiProperties._parse_account_from_propkey(settingsdir, propkey)
+                if name == None:
+                    # not a contact, i.e. the copy of an account's own key
+                    # that write() also stores without the protocol prefix
+                    continue
                 if name in keydict:
                     key = keydict[name]
                 else:
@@ -193,7 +215,8 @@ class JitsiProperties():
                                + '_' + servername + '_privateKey')
                     p.setProperty(privkey, otrapps.util.ExportDsaPkcs8(key))
 		   		
-        p.store(open(savefile, 'w'))
+        # store() adds a timestamp comment, which should not count as a change
+        p.store(otrapps.util.OutputFile(savefile, comment='#'))
 
 
 
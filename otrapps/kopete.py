@@ -65,10 +65,11 @@ class KopeteProperties():
         if not os.path.exists(savedir):
             raise Exception('"' + savedir + '" does not exist!')
 
-        for key in keydict:
-            for value in keydict[key]:
-                if value == 'protocol':
-                    keydict[key][value] = KopeteProperties._convert_protocol_name(keydict[key][value])
+        protocols = dict()
+        for key in keydict.values():
+            if 'protocol' in key and key['protocol'] not in protocols:
+                protocols[key['protocol']] = KopeteProperties._convert_protocol_name(key['protocol'])
+        keydict = otrapps.util.KeydictView(keydict, protocol=protocols)
 
         kf = os.path.join(savedir, KopeteProperties.keyfile)
         OtrPrivateKeys.write(keydict, kf)
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''counters and histograms about each sync, for Prometheus or as JSON'''
+
+from __future__ import print_function
+import numbers
+import os
+import sys
+import tempfile
+import threading
+import time
+
+if __name__ == '__main__':
+    sys.path.insert(0, "../") # so the main() test suite can find otrapps module
+import otrapps.stages as stages
+
+# in seconds, from a small keystore on a fast disk up to a slow device sync
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# set by keysync when the metrics will be written out, the counters that
+# take extra work to fill in are only filled in then
+enabled = False
+
+
+def _labelkey(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labelkey, extra=()):
+    items = list(labelkey) + list(extra)
+    if not items:
+        return ''
+    escaped = []
+    for name, value in items:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append('%s="%s"' % (name, value))
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, numbers.Integral):
+        return str(value)
+    return repr(float(value))
+
+
+class Counter():
+    '''a value that only goes up, one per set of labels'''
+
+    type = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = dict()
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = _labelkey(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def get(self, **labels):
+        return self.values.get(_labelkey(labels), 0)
+
+    def as_list(self):
+        return [{'labels': dict(key), 'value': value}
+                for key, value in sorted(self.values.items())]
+
+    def prometheus_lines(self):
+        return ['%s%s %s' % (self.name, _format_labels(key), _format_value(value))
+                for key, value in sorted(self.values.items())]
+
+
+class Histogram():
+    '''counts observations into cumulative buckets, one per set of labels'''
+
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self.values = dict()
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _labelkey(labels)
+        with self._lock:
+            if key not in self.values:
+                self.values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            entry = self.values[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry['counts'][i] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+
+    def as_list(self):
+        result = []
+        for key, entry in sorted(self.values.items()):
+            buckets = [[_format_value(bound), count]
+                       for bound, count in zip(self.buckets, entry['counts'])]
+            result.append({'labels': dict(key), 'buckets': buckets,
+                           'sum': entry['sum'], 'count': entry['count']})
+        return result
+
+    def prometheus_lines(self):
+        lines = []
+        for key, entry in sorted(self.values.items()):
+            for bound, count in zip(self.buckets, entry['counts']):
+                lines.append('%s_bucket%s %d' % (self.name,
+                                                 _format_labels(key, [('le', _format_value(bound))]),
+                                                 count))
+            lines.append('%s_sum%s %s' % (self.name, _format_labels(key), _format_value(entry['sum'])))
+            lines.append('%s_count%s %d' % (self.name, _format_labels(key), entry['count']))
+        return lines
+
+
+class Registry():
+    '''all of the metrics by name, in the order they were registered'''
+
+    def __init__(self):
+        self.metrics = []
+        self._byname = dict()
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._byname:
+                existing = self._byname[metric.name]
+                if existing.type != metric.type:
+                    raise Exception('"' + metric.name + '" is already registered as a ' + existing.type)
+                return existing
+            self._byname[metric.name] = metric
+            self.metrics.append(metric)
+            return metric
+
+    def counter(self, name, help):
+        '''get the named counter, creating it if needed'''
+        return self._register(Counter(name, help))
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        '''get the named histogram, creating it if needed'''
+        return self._register(Histogram(name, help, buckets))
+
+    def as_dict(self):
+        '''all of the metrics, ready for JSON'''
+        return dict((m.name, {'type': m.type, 'help': m.help, 'values': m.as_list()})
+                    for m in self.metrics)
+
+    def prometheus_text(self):
+        '''all of the metrics in the Prometheus text exposition format'''
+        lines = []
+        for m in self.metrics:
+            lines.append('# HELP %s %s' % (m.name, m.help))
+            lines.append('# TYPE %s %s' % (m.name, m.type))
+            lines += m.prometheus_lines()
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, filename):
+        '''
+        Write for the node_exporter textfile collector, which might read the
+        file at any moment, so write it to a temp file then rename it.
+        '''
+        folder = os.path.dirname(os.path.abspath(filename))
+        fd, tmpname = tempfile.mkstemp(dir=folder, prefix='.' + os.path.basename(filename))
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.prometheus_text())
+        if sys.platform == 'win32' and os.path.exists(filename):
+            os.remove(filename) # rename cannot replace on Windows
+        os.rename(tmpname, filename)
+
+    def write_json(self, filename):
+        import json
+        with open(filename, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2, sort_keys=True)
+
+
+# the registry that keysync and the otrapps modules report to
+registry = Registry()
+
+keys_parsed = registry.counter('keysync_keys_parsed_total',
+                               'keys read in, by app and kind (private or public)')
+merge_conflicts = registry.counter('keysync_merge_conflicts_total',
+                                   'values that did not match when merging keys, by field')
+bytes_written = registry.counter('keysync_bytes_written_total',
+                                 'bytes of files written, by output app')
+device_bytes = registry.counter('keysync_device_sync_bytes_total',
+                                'bytes copied to devices')
+device_skips = registry.counter('keysync_device_sync_skipped_total',
+                                'copies to devices skipped, the device already had the same file')
+stage_seconds = registry.histogram('keysync_stage_duration_seconds',
+                                   'wall time of each stage of a sync, by stage and app, '
+                                   'i.e. stage="encrypt" for openssl, stage="sync" for devices')
+
+
+def count_keys(app, keydict):
+    '''count the private and public keys that app's parser returned'''
+    private = 0
+    for key in keydict.values():
+        if 'x' in key:
+            private += 1
+    keys_parsed.inc(private, app=app, kind='private')
+    keys_parsed.inc(len(keydict) - private, app=app, kind='public')
+
+
+def count_written(app, outputs):
+    '''count the bytes written by app, from its (filename, status, size) entries of output_log'''
+    written = 0
+    for filename, status, size in outputs:
+        if status != 'unchanged':
+            written += size
+    bytes_written.inc(written, app=app)
+    return written
+
+
+class StageMetrics():
+    '''a stages hook that feeds each stage's wall time into stage_seconds'''
+
+    def __init__(self, histogram=None):
+        self.histogram = histogram or stage_seconds
+        self._started = []
+
+    def __call__(self, event, name, app):
+        if event == 'start':
+            self._started.append(time.time())
+        else:
+            self.histogram.observe(time.time() - self._started.pop(),
+                                   stage=name, app=app or '')
+
+
+#------------------------------------------------------------------------------#
+# for testing from the command line:
+def main(argv):
+    r = Registry()
+    c = r.counter('test_total', 'a test counter')
+    c.inc(app='pidgin', kind='private')
+    c.inc(3, app='pidgin', kind='public')
+    h = r.histogram('test_seconds', 'a test histogram', buckets=(0.1, 1.0))
+    h.observe(0.05, stage='parse')
+    h.observe(0.5, stage='parse')
+    print(r.prometheus_text())
+    print(r.as_dict())
+
+    hook = StageMetrics(h)
+    stages.add_hook(hook)
+    with stages.stage('write', 'irssi'):
+        pass
+    stages.remove_hook(hook)
+    print(r.prometheus_text())
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -3,25 +3,149 @@
 '''a module for reading and writing libotr's public key data'''
 
 from __future__ import print_function
+import binascii
 import csv
+import sys
+
+if __name__ == '__main__':
+    sys.path.insert(0, "../") # so the main() test suite can find otrapps module
+import otrapps.stages as stages
+import otrapps.util
+
+try:
+    intern
+except NameError:
+    intern = sys.intern # python 3
+
+
+def _pack(fingerprint):
+    '''the 40 hex digits of a fingerprint as 20 bytes, or None if it is not one'''
+    if len(fingerprint) != 40:
+        return None
+    try:
+        return binascii.unhexlify(fingerprint)
+    except (TypeError, ValueError): # binascii.Error is a ValueError
+        return None
+
+
+def _unpack(packed):
+    return str(binascii.hexlify(packed).decode('ascii'))
+
+
+class FingerprintIndex():
+    '''
+    Every fingerprint row of libotr's fingerprints files, by buddy, so a
+    buddy with many devices keeps all of them.  Each row is a tuple of the
+    account, protocol, the fingerprint packed into 20 bytes, and the
+    verification.  The accounts, protocols and verifications are interned,
+    since the same few are repeated on every row.
+    '''
+
+    def __init__(self):
+        self._buddies = dict()
+        self._names = [] # in the order they were first added, for writing
+        self._verified = set()
+        self._rows = 0
+
+    def add(self, name, account, protocol, fingerprint, verification=None):
+        '''add a row, verification is None if the trust column was left off'''
+        packed = _pack(fingerprint)
+        if packed is None:
+            raise Exception('"' + fingerprint + '" for "' + name + '" is not a fingerprint')
+        if verification is not None:
+            verification = intern(str(verification))
+            if verification:
+                self._verified.add(packed)
+        entry = (intern(str(account)), intern(str(protocol)), packed, verification)
+        if name not in self._buddies:
+            self._buddies[name] = [entry]
+            self._names.append(name)
+        else:
+            self._buddies[name].append(entry)
+        self._rows += 1
+
+    def fingerprints(self, name):
+        '''all of the (account, protocol, fingerprint, verification) rows of a buddy'''
+        return [(account, protocol, _unpack(packed), verification)
+                for account, protocol, packed, verification in self._buddies.get(name, ())]
+
+    def is_verified(self, fingerprint):
+        '''whether the fingerprint is verified by any account'''
+        return _pack(fingerprint.lower()) in self._verified
+
+    def rows(self):
+        '''yield every row as it would be written to the fingerprints file'''
+        for name in self._names:
+            for account, protocol, packed, verification in self._buddies[name]:
+                row = [name, account, protocol, _unpack(packed)]
+                if verification is not None:
+                    row.append(verification)
+                yield row
+
+    def __contains__(self, name):
+        return name in self._buddies
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return self._rows
+
 
 class OtrFingerprints():
 
+    @staticmethod
+    def _row_to_key(row):
+        key = dict()
+        key['name'] = row[0].strip()
+        key['protocol'] = row[2].strip()
+        key['fingerprint'] = row[3].strip()
+        # like libotr, allow the trust column to be left off
+        if len(row) > 4:
+            key['verification'] = row[4].strip()
+        else:
+            key['verification'] = ''
+        return key
+
     @staticmethod
     def parse(filename):
         '''parse the otr.fingerprints file and return a list of keydicts'''
-        tsv = csv.reader(open(filename, 'r'), delimiter='\t')
+        with stages.stage('read'):
+            with open(filename, 'r') as f:
+                lines = f.readlines()
+        tsv = csv.reader(lines, delimiter='\t')
         keydict = dict()
         for row in tsv:
-            key = dict()
-            name = row[0].strip()
-            key['name'] = name
-            key['protocol'] = row[2].strip()
-            key['fingerprint'] = row[3].strip()
-            key['verification'] = row[4].strip()
-            keydict[name] = key
+            key = OtrFingerprints._row_to_key(row)
+            keydict[key['name']] = key
         return keydict
 
+    @staticmethod
+    def iter_records(filename):
+        '''yield a key for each row of the otr.fingerprints file as it is read'''
+        with open(filename, 'r') as f:
+            for row in csv.reader(f, delimiter='\t'):
+                yield OtrFingerprints._row_to_key(row)
+
+    @staticmethod
+    def parse_index(filename):
+        '''parse the otr.fingerprints file into a FingerprintIndex of every row'''
+        index = FingerprintIndex()
+        with stages.stage('read'):
+            with open(filename, 'r') as f:
+                for row in csv.reader(f, delimiter='\t'):
+                    if len(row) < 4:
+                        continue
+                    verification = None
+                    if len(row) > 4:
+                        verification = row[4].strip()
+                    try:
+                        index.add(row[0].strip(), row[1].strip(), row[2].strip(),
+                                  row[3].strip(), verification)
+                    except Exception as e:
+                        print('WARNING: skipping a row of "' + filename + '": ' + str(e))
+        return index
+
     @staticmethod
     def _includexmppresource(accounts, resources):
         '''pidgin requires the XMPP Resource in the name of the associated account'''
@@ -34,27 +158,78 @@ class OtrFingerprints():
         return returnlist
 
     @staticmethod
-    def write(keydict, filename, accounts, resources=None):
-        if resources:
-            accounts = OtrFingerprints._includexmppresource(accounts, resources)
-        # we have to use this list 'accounts' rather than the private
-        # keys in the keydict in order to support apps like Adium that
-        # don't use the actual account ID as the index in the files.
-        tsv = csv.writer(open(filename, 'w'), delimiter='\t')
-        for name, key in keydict.items():
-            if 'fingerprint' in key:
-                for account in accounts:
-                    row = [name, account, key['protocol'], key['fingerprint']]
-                    if 'verification' in key and key['verification'] != None:
-                        row.append(key['verification'])
-                    tsv.writerow(row)
+    def write(keydict, filename, accounts=None, resources=None):
+        '''
+        Write either a keydict, with a row for each of its fingerprints for
+        each of the accounts, or a FingerprintIndex, which already has the
+        account of each row, so accounts is not used.  The rows are
+        streamed through a temp file next to filename, so the whole file is
+        never held in memory.
+        '''
+        with otrapps.util.SpooledOutputFile(filename) as f:
+            if isinstance(keydict, FingerprintIndex):
+                csv.writer(f, delimiter='\t').writerows(keydict.rows())
+            else:
+                if resources:
+                    accounts = OtrFingerprints._includexmppresource(accounts, resources)
+                # we have to use this list 'accounts' rather than the private
+                # keys in the keydict in order to support apps like Adium that
+                # don't use the actual account ID as the index in the files.
+                writer = FingerprintWriter(f, accounts)
+                for name, key in keydict.items():
+                    writer.write(name, key)
+
 
+class FingerprintWriter():
+    '''
+    Writes the rows of a fingerprints file one key at a time, a row for
+    each of the accounts, so the keys can be streamed in.
+    '''
+
+    def __init__(self, f, accounts):
+        self.accounts = accounts
+        self._tsv = csv.writer(f, delimiter='\t')
+
+    def write(self, name, key):
+        if 'fingerprint' in key:
+            for account in self.accounts:
+                row = [name, account, key['protocol'], key['fingerprint']]
+                if 'verification' in key and key['verification'] != None:
+                    row.append(key['verification'])
+                self._tsv.writerow(row)
 
 if __name__ == '__main__':
 
-    import sys
+    import os
     import pprint
-    keydict = OtrFingerprints.parse(sys.argv[1])
+    import tempfile
+    if len(sys.argv) == 2:
+        filename = sys.argv[1]
+    else:
+        filename = '../tests/pidgin/otr.fingerprints'
+    keydict = OtrFingerprints.parse(filename)
     pprint.pprint(keydict)
     accounts = [ 'gptest@jabber.org', 'gptest@limun.org', 'hans@eds.org']
-    OtrFingerprints.write(keydict, 'otr.fingerprints', accounts)
+    tmpdir = tempfile.mkdtemp(prefix='.keysync-fingerprints-test-')
+    OtrFingerprints.write(keydict, os.path.join(tmpdir, 'otr.fingerprints'), accounts)
+
+    index = OtrFingerprints.parse_index(filename)
+    print('%d rows for %d buddies' % (len(index), len(list(index))))
+    for name in index:
+        if len(index.fingerprints(name)) > 1:
+            print(name + ':')
+            pprint.pprint(index.fingerprints(name))
+            break
+    for row in index.rows():
+        print(row[3] + ' verified: ' + str(index.is_verified(row[3])))
+        break
+    # every row should come back out, even for buddies with many fingerprints
+    copy = os.path.join(tmpdir, 'otr.fingerprints.index')
+    OtrFingerprints.write(index, copy)
+    with open(filename) as f:
+        before = sorted(line.rstrip('\r\n') for line in f if line.count('\t') >= 3)
+    with open(copy) as f:
+        after = sorted(line.rstrip('\r\n') for line in f)
+    if before != after:
+        raise Exception('"' + copy + '" does not have the same rows as "' + filename + '"')
+    print('wrote the same %d rows back out' % len(after))
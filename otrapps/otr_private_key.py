@@ -11,6 +11,7 @@ import sys
 
 if __name__ == '__main__':
     sys.path.insert(0, "../") # so the main() test suite can find otrapps module
+import otrapps.stages as stages
 import otrapps.util
 
 class OtrPrivateKeys():
@@ -64,11 +65,12 @@ class OtrPrivateKeys():
     def parse(filename):
         '''parse the otr.private_key S-Expression and return an OTR dict'''
 
-        f = open(filename, 'r')
-        data = ""
-        for line in f.readlines():
-            data += line
-        f.close()
+        with stages.stage('read'):
+            f = open(filename, 'r')
+            data = ""
+            for line in f.readlines():
+                data += line
+            f.close()
 
         sexplist = OtrPrivateKeys.parse_sexp(data)
         keydict = dict()
@@ -127,9 +129,7 @@ class OtrPrivateKeys():
                              '(private-key \n (dsa \n' + dsa + '  )\n )\n')
                 privkeys += ' (account\n' + contents + ' )\n'
         privkeys += ')\n'
-        f = open(filename, 'w')
-        f.write(privkeys)
-        f.close()
+        otrapps.util.save_output(filename, privkeys)
 
 if __name__ == "__main__":
     import sys
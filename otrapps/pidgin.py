@@ -9,6 +9,7 @@ from bs4 import BeautifulSoup
 
 if __name__ == '__main__':
     sys.path.insert(0, "../") # so the main() test suite can find otrapps module
+import otrapps.pipeline
 import otrapps.util
 from otrapps.otr_private_key import OtrPrivateKeys
 from otrapps.otr_fingerprints import OtrFingerprints
@@ -44,6 +45,35 @@ class PidginProperties():
                 resources[name] = ''
         return resources
 
+    @staticmethod
+    def get_accounts(settingsdir=None):
+        '''get the name, protocol, and XMPP Resource of every Pidgin account'''
+        if settingsdir == None:
+            settingsdir = PidginProperties.path
+        accounts = []
+        accountsfile = os.path.join(settingsdir, PidginProperties.accountsfile)
+        if not os.path.exists(accountsfile):
+            return accounts
+        xml = ''
+        for line in open(accountsfile, 'r').readlines():
+            xml += line
+        for e in BeautifulSoup(xml)('protocol'):
+            name = e.parent.find('name')
+            if name is None or not name.contents:
+                continue
+            account = dict()
+            account['protocol'] = str(e.string).strip()
+            account['name'] = str(name.contents[0])
+            if account['protocol'] == 'prpl-jabber':
+                pidginname = account['name'].split('/')
+                account['name'] = pidginname[0]
+                if len(pidginname) == 2:
+                    account['resource'] = pidginname[1]
+                else:
+                    account['resource'] = ''
+            accounts.append(account)
+        return accounts
+
     @staticmethod
     def parse(settingsdir=None):
         if settingsdir == None:
@@ -69,13 +99,30 @@ class PidginProperties():
         return keydict
 
     @staticmethod
-    def write(keydict, savedir):
-        if not os.path.exists(savedir):
-            raise Exception('"' + savedir + '" does not exist!')
+    def iter_keys(settingsdir=None):
+        '''yield the private keys, then a key for each fingerprint row as it is read'''
+        if settingsdir == None:
+            settingsdir = PidginProperties.path
 
-        kf = os.path.join(savedir, PidginProperties.keyfile)
-        # Pidgin requires the XMPP resource in the account name field of the
-        # OTR private keys file, so fetch it from the existing account info
+        kf = os.path.join(settingsdir, PidginProperties.keyfile)
+        if os.path.exists(kf):
+            resources = PidginProperties._get_resources(settingsdir)
+            for name, key in OtrPrivateKeys.parse(kf).items():
+                if key['protocol'] == 'prpl-jabber' and name in resources.keys():
+                    key['resource'] = resources[name]
+                yield key
+
+        fpf = os.path.join(settingsdir, PidginProperties.fingerprintfile)
+        if os.path.exists(fpf):
+            for key in OtrFingerprints.iter_records(fpf):
+                yield key
+
+    @staticmethod
+    def _get_output_resources(savedir):
+        '''
+        Pidgin requires the XMPP resource in the account name field of the
+        OTR private keys file, so fetch it from the existing account info
+        '''
         if os.path.exists(os.path.join(savedir, PidginProperties.accountsfile)):
             accountsdir = savedir
         elif os.path.exists(os.path.join(PidginProperties.path,
@@ -84,7 +131,15 @@ class PidginProperties():
         else:
             raise Exception('Cannot find "' + PidginProperties.accountsfile
                             + '" in "' + savedir + '"')
-        resources = PidginProperties._get_resources(accountsdir)
+        return PidginProperties._get_resources(accountsdir)
+
+    @staticmethod
+    def write(keydict, savedir):
+        if not os.path.exists(savedir):
+            raise Exception('"' + savedir + '" does not exist!')
+
+        kf = os.path.join(savedir, PidginProperties.keyfile)
+        resources = PidginProperties._get_output_resources(savedir)
         OtrPrivateKeys.write(keydict, kf, resources=resources)
 
         accounts = []
@@ -95,6 +150,16 @@ class PidginProperties():
         fpf = os.path.join(savedir, PidginProperties.fingerprintfile)
         OtrFingerprints.write(keydict, fpf, accounts, resources=resources)
 
+    @staticmethod
+    def stream_writer(savedir, private_keys):
+        '''a writer to stream the fingerprints into, see otrapps.pipeline'''
+        if not os.path.exists(savedir):
+            raise Exception('"' + savedir + '" does not exist!')
+        return otrapps.pipeline.LibotrWriter(os.path.join(savedir, PidginProperties.keyfile),
+                                             os.path.join(savedir, PidginProperties.fingerprintfile),
+                                             private_keys,
+                                             PidginProperties._get_output_resources(savedir))
+
 
 if __name__ == '__main__':
 
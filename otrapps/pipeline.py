@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''stream the keys from the readers, through the merge, to the writers'''
+
+from __future__ import print_function
+import itertools
+import sys
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue # python 2
+# if python < 2.7, get OrderedDict from a standalone lib
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+if __name__ == '__main__':
+    sys.path.insert(0, "../") # so the main() test suite can find otrapps module
+import otrapps
+import otrapps.metrics
+import otrapps.util
+from otrapps.otr_private_key import OtrPrivateKeys
+from otrapps.otr_fingerprints import OtrFingerprints, FingerprintWriter
+
+# how many keys can wait for each writer before the readers have to wait
+DEFAULT_DEPTH = 1024
+
+_DONE = object()
+_ABORT = object()
+
+
+def iter_keys(app, settingsdir=None):
+    '''
+    Yield each key of app, all of the private keys first.  The apps with
+    their own iter_keys() stream their keys as they are read, the rest are
+    parsed in one go.
+    '''
+    properties = otrapps.apps[app]
+    if hasattr(properties, 'iter_keys'):
+        for key in properties.iter_keys(settingsdir):
+            yield key
+        return
+    if app == 'chatsecure':
+        raise Exception('"' + app + '" cannot be streamed, its keystore has to be decrypted first')
+    if settingsdir is None:
+        keydict = properties.parse()
+    else:
+        keydict = properties.parse(settingsdir)
+    for key in keydict.values():
+        if 'x' in key:
+            yield key
+    for key in keydict.values():
+        if 'x' not in key:
+            yield key
+
+
+def merge(keys, keydict=None):
+    '''fold a stream of keys into keydict, like merge_keydicts() does'''
+    if keydict is None:
+        keydict = dict()
+    for key in keys:
+        name = key['name']
+        if name in keydict:
+            otrapps.util.merge_keys(keydict[name], key)
+        else:
+            keydict[name] = key
+    return keydict
+
+
+def can_stream(app):
+    '''whether app's output can be written as the keys come in'''
+    return hasattr(otrapps.apps[app], 'stream_writer')
+
+
+class LibotrWriter():
+    '''
+    Streams keys into libotr's pair of files.  The private keys are all known
+    before it starts, so the private key file is written right away.  Then
+    the fingerprint rows of each key are written as it comes in, once per
+    (name, fingerprint), through a temp file instead of memory.  A row that
+    turns out to be verified after it was written is written again, since
+    libotr takes the last row of each fingerprint.
+    '''
+
+    def __init__(self, keyfile, fingerprintfile, private_keys, resources=None):
+        OtrPrivateKeys.write(private_keys, keyfile, resources=resources)
+        accounts = [name for name, key in private_keys.items() if 'x' in key]
+        if resources:
+            accounts = OtrFingerprints._includexmppresource(accounts, resources)
+        self.file = otrapps.util.SpooledOutputFile(fingerprintfile)
+        self._fingerprints = FingerprintWriter(self.file, accounts)
+        self._verification = dict() # what was written for each (name, fingerprint)
+        for key in private_keys.values():
+            self.write(key)
+
+    def write(self, key):
+        if 'fingerprint' not in key:
+            return
+        seen = (key['name'], key['fingerprint'])
+        verification = key.get('verification')
+        if seen not in self._verification or (verification and not self._verification[seen]):
+            self._verification[seen] = verification
+            self._fingerprints.write(key['name'], key)
+
+    def close(self):
+        self.file.close()
+
+    def abort(self):
+        self.file.abort()
+
+
+class QueueWriter():
+    '''feeds a writer on its own thread through a bounded queue'''
+
+    def __init__(self, writer, depth=DEFAULT_DEPTH):
+        self.writer = writer
+        self.error = None
+        self._queue = queue.Queue(maxsize=depth)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        key = None
+        try:
+            while True:
+                key = self._queue.get()
+                if key is _DONE:
+                    self.writer.close()
+                    return
+                if key is _ABORT:
+                    self.writer.abort()
+                    return
+                self.writer.write(key)
+        except Exception as e:
+            self.error = e
+            self.writer.abort()
+            # keep taking keys so whoever is putting them in never gets stuck
+            while key is not _DONE and key is not _ABORT:
+                key = self._queue.get()
+
+    def put(self, key):
+        if self.error is not None:
+            raise self.error
+        self._queue.put(key)
+
+    def close(self, abort=False):
+        '''wait for the writer to finish, raising anything it raised'''
+        if abort:
+            self._queue.put(_ABORT)
+        else:
+            self._queue.put(_DONE)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def run(inputs, outputs, savedir, settingsdirs=None, keydict=None, depth=DEFAULT_DEPTH):
+    '''
+    Stream the keys of each of the inputs to each of the outputs, which
+    must all be able to take a stream, each through its own bounded queue.
+    Every output needs all of the private keys before it can write any
+    fingerprints, so those are read first.  They are only one per account.
+    If keydict is given, the keys of each input are also merged into it
+    the way merge_keydicts() merges what parse() returned, i.e. for the
+    outputs that need all of the keys at once.  Otherwise, only the queues
+    and the private keys are held in memory.  Returns how many keys were
+    read.
+    '''
+    if settingsdirs is None:
+        settingsdirs = dict()
+    private_keys = dict()
+    streams = []
+    count = 0
+    for app in inputs:
+        app_keys = dict()
+        keys = iter_keys(app, settingsdirs.get(app))
+        rest = iter(())
+        for key in keys:
+            count += 1
+            if 'x' in key:
+                merge([key], app_keys)
+            else:
+                # the rest of this app's keys are streamed below
+                rest = itertools.chain([key], keys)
+                break
+        # copies, since merging into app_keys below changes its keys
+        merge([dict(key) for key in app_keys.values()], private_keys)
+        streams.append((app_keys, rest))
+    private_keys = otrapps.util.KeydictView(OrderedDict(sorted(private_keys.items())))
+
+    writers = []
+    logged = dict() # what each output added to output_log, for the metrics
+    try:
+        for app in outputs:
+            start = len(otrapps.util.output_log)
+            writers.append(QueueWriter(otrapps.apps[app].stream_writer(savedir, private_keys),
+                                       depth))
+            logged[app] = otrapps.util.output_log[start:]
+        for app_keys, keys in streams:
+            rows = dict()
+            for key in keys:
+                count += 1
+                for writer in writers:
+                    writer.put(key)
+                if keydict is not None:
+                    # like parse(), the last row of a buddy with several
+                    # fingerprints is the one that is kept
+                    rows[key['name']] = key
+            if keydict is not None:
+                otrapps.util.merge_keydicts(app_keys, rows)
+                otrapps.util.merge_keydicts(keydict, app_keys)
+    except BaseException:
+        for writer in writers:
+            try:
+                writer.close(abort=True)
+            except Exception:
+                pass # the first error is the one to report
+        raise
+    # one at a time, so what each one adds to output_log is its own
+    for app, writer in zip(outputs, writers):
+        start = len(otrapps.util.output_log)
+        writer.close()
+        logged[app] += otrapps.util.output_log[start:]
+    if otrapps.metrics.enabled and not otrapps.util.dry_run:
+        for app in outputs:
+            otrapps.metrics.count_written(app, logged[app])
+    return count
+
+
+#------------------------------------------------------------------------------#
+# for testing from the command line:
+def main(argv):
+    import os
+    import shutil
+    import tempfile
+
+    testdir = os.path.join('..', 'tests')
+    inputs = ['pidgin', 'irssi', 'xchat']
+    settingsdirs = dict((app, os.path.join(testdir, app)) for app in inputs)
+    tmpdir = tempfile.mkdtemp(prefix='.keysync-pipeline-test-')
+    shutil.copy(os.path.join(testdir, 'pidgin', 'accounts.xml'), tmpdir)
+
+    keydict = dict()
+    count = run(inputs, ['irssi', 'pidgin', 'xchat'], tmpdir, settingsdirs, keydict, depth=2)
+    print('streamed %d keys, %d after merging' % (count, len(keydict)))
+    for filename in sorted(os.listdir(tmpdir)):
+        print(filename + ': ' + str(os.path.getsize(os.path.join(tmpdir, filename))) + ' bytes')
+
+    # the same rows should come out of the streamed and the merged writers
+    merged = os.path.join(tmpdir, 'merged')
+    os.mkdir(merged)
+    otrapps.apps['irssi'].write(keydict, merged)
+    for filename in ('otr.key', 'otr.fp'):
+        with open(os.path.join(tmpdir, filename)) as f:
+            streamed = sorted(f.readlines())
+        with open(os.path.join(merged, filename)) as f:
+            written = sorted(f.readlines())
+        # streaming keeps every fingerprint of a buddy, the keydict only one
+        if set(written) - set(streamed):
+            raise Exception('"' + filename + '" is missing lines when streamed!')
+        print('%s: %d lines streamed, %d merged' % (filename, len(streamed), len(written)))
+    shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''a module for reading XML and binary property lists, i.e. Adium's'''
+
+from __future__ import print_function
+import datetime
+import plistlib
+import struct
+import sys
+
+BINARY_MAGIC = b'bplist00'
+# binary plist dates are seconds from here
+EPOCH = datetime.datetime(2001, 1, 1)
+
+
+def read(filename):
+    '''read a plist file in either format, the file is never changed'''
+    with open(filename, 'rb') as f:
+        data = f.read()
+    return loads(data, filename)
+
+
+def loads(data, filename='plist'):
+    if data.startswith(BINARY_MAGIC):
+        return BinaryPlistReader(data, filename).parse()
+    if hasattr(plistlib, 'loads'): # python >= 3.4
+        return plistlib.loads(data)
+    return plistlib.readPlistFromString(data)
+
+
+def _str(data, encoding):
+    '''like plistlib in python 2, give str when the text is plain ASCII'''
+    text = data.decode(encoding)
+    if sys.version_info[0] == 2:
+        try:
+            return text.encode('ascii')
+        except UnicodeEncodeError:
+            pass
+    return text
+
+
+def _uint(data):
+    value = 0
+    for byte in bytearray(data):
+        value = (value << 8) | byte
+    return value
+
+
+class BinaryPlistReader():
+    '''
+    Apple's binary plist format, "bplist00": a trailer at the end gives the
+    offset table, which gives where each object starts, and containers
+    refer to other objects by their index in that table.
+    '''
+
+    def __init__(self, data, filename='plist'):
+        self.data = data
+        self.filename = filename
+        self._objects = dict()
+
+    def _error(self, msg):
+        return Exception('"' + self.filename + '" is not a valid binary plist: ' + msg)
+
+    def parse(self):
+        if len(self.data) < len(BINARY_MAGIC) + 32:
+            raise self._error('too short')
+        (self.offset_size, self.ref_size, num_objects, top_object,
+         table_offset) = struct.unpack('>6xBBQQQ', self.data[-32:])
+        if table_offset + num_objects * self.offset_size > len(self.data) - 32:
+            raise self._error('offset table is out of range')
+        self.offsets = []
+        for i in range(num_objects):
+            start = table_offset + i * self.offset_size
+            self.offsets.append(_uint(self.data[start:start + self.offset_size]))
+        return self._object(top_object, ())
+
+    def _refs(self, start, count):
+        size = self.ref_size
+        return [_uint(self.data[start + i * size:start + (i + 1) * size]) for i in range(count)]
+
+    def _length(self, info, offset):
+        '''the length is in the low nibble, or in an int object that follows'''
+        if info != 0xF:
+            return info, offset + 1
+        marker = bytearray(self.data[offset + 1:offset + 2])[0]
+        if marker >> 4 != 0x1:
+            raise self._error('bad length at ' + str(offset))
+        size = 1 << (marker & 0xF)
+        return _uint(self.data[offset + 2:offset + 2 + size]), offset + 2 + size
+
+    def _object(self, ref, parents):
+        if ref in self._objects:
+            return self._objects[ref]
+        if ref >= len(self.offsets) or ref in parents:
+            raise self._error('bad reference ' + str(ref))
+        offset = self.offsets[ref]
+        marker = bytearray(self.data[offset:offset + 1])[0]
+        kind, info = marker >> 4, marker & 0xF
+
+        if marker == 0x00:
+            value = None
+        elif marker == 0x08:
+            value = False
+        elif marker == 0x09:
+            value = True
+        elif kind == 0x1:
+            size = 1 << info
+            value = _uint(self.data[offset + 1:offset + 1 + size])
+            if size >= 8 and value >= 1 << (size * 8 - 1):
+                value -= 1 << (size * 8) # 8 and 16 byte ints are signed
+        elif kind == 0x2:
+            if info == 2:
+                value = struct.unpack('>f', self.data[offset + 1:offset + 5])[0]
+            else:
+                value = struct.unpack('>d', self.data[offset + 1:offset + 9])[0]
+        elif marker == 0x33:
+            seconds = struct.unpack('>d', self.data[offset + 1:offset + 9])[0]
+            value = EPOCH + datetime.timedelta(seconds=seconds)
+        elif kind == 0x4:
+            length, start = self._length(info, offset)
+            value = self.data[start:start + length]
+        elif kind == 0x5:
+            length, start = self._length(info, offset)
+            value = _str(self.data[start:start + length], 'ascii')
+        elif kind == 0x6:
+            length, start = self._length(info, offset)
+            value = _str(self.data[start:start + length * 2], 'utf-16-be')
+        elif kind == 0x8:
+            value = _uint(self.data[offset + 1:offset + 2 + info])
+        elif kind in (0xA, 0xC):
+            length, start = self._length(info, offset)
+            parents = parents + (ref,)
+            value = [self._object(r, parents) for r in self._refs(start, length)]
+        elif kind == 0xD:
+            length, start = self._length(info, offset)
+            parents = parents + (ref,)
+            keys = self._refs(start, length)
+            values = self._refs(start + length * self.ref_size, length)
+            value = dict()
+            for k, v in zip(keys, values):
+                value[self._object(k, parents)] = self._object(v, parents)
+        else:
+            raise self._error('unknown object type 0x%02x at %d' % (marker, offset))
+
+        self._objects[ref] = value
+        return value
+
+
+#------------------------------------------------------------------------------#
+# for testing from the command line:
+def main(argv):
+    import os
+    import pprint
+
+    if argv:
+        filenames = argv
+    else:
+        adiumdir = os.path.join('..', 'tests', 'adium')
+        filenames = [os.path.join(adiumdir, 'Accounts.plist')]
+        userdir = os.path.join(adiumdir, 'Library', 'Application Support', 'Adium 2.0',
+                               'Users', 'Default')
+        filenames += sorted(os.path.join(userdir, f) for f in os.listdir(userdir)
+                            if f.endswith('.plist'))
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            data = f.read()
+        plist = read(filename)
+        if data.startswith(BINARY_MAGIC) and hasattr(plistlib, 'loads'):
+            # check against python's own binary plist reader
+            expected = plistlib.loads(data)
+            if plist != expected:
+                raise Exception('"' + filename + '" was read differently than plistlib does')
+        print('----------------------------------------')
+        print(filename)
+        pprint.pprint(plist)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''hooks at the boundaries of each stage of a sync, for timing and the like'''
+
+from __future__ import print_function
+import sys
+import time
+from contextlib import contextmanager
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None # python < 3.4
+try:
+    import resource
+except ImportError:
+    resource = None # not on Windows
+
+# the stages that keysync marks, stages can be nested, i.e. 'fingerprint'
+# happens inside of 'parse', and 'encrypt' inside of 'write'.  'sync' is
+# copying the keystore to a device.
+STAGES = ('read', 'parse', 'fingerprint', 'merge', 'sort', 'write', 'encrypt', 'decrypt',
+          'sync')
+
+_hooks = []
+_apps = [None] # the app of the innermost stage that named one
+
+if hasattr(time, 'process_time'):
+    cpu_time = time.process_time
+else:
+    cpu_time = time.clock # python < 3.3, this is CPU time on UNIX
+
+
+def add_hook(hook):
+    '''
+    hook(event, stage, app) is called with event 'start' before, and 'end'
+    after each stage.  app is None for stages that are not about one app.
+    '''
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+@contextmanager
+def stage(name, app=None):
+    '''mark a stage of the sync, nested stages inherit app if not given'''
+    if not _hooks:
+        # nobody is listening, so keep this as cheap as possible
+        yield
+        return
+    if app is None:
+        app = _apps[-1]
+    _apps.append(app)
+    for hook in list(_hooks):
+        hook('start', name, app)
+    try:
+        yield
+    finally:
+        _apps.pop()
+        for hook in list(_hooks):
+            hook('end', name, app)
+
+
+class StageTimer():
+    '''a hook that adds up the wall and CPU time of each stage, per app'''
+
+    def __init__(self):
+        self.totals = dict()
+        self._started = []
+
+    def __call__(self, event, name, app):
+        if event == 'start':
+            self._started.append((name, app, time.time(), cpu_time()))
+            return
+        name, app, wall, cpu = self._started.pop()
+        wall = time.time() - wall
+        cpu = cpu_time() - cpu
+        keys = [(name, None)]
+        if app is not None:
+            keys.append((name, app))
+        for key in keys:
+            total = self.totals.setdefault(key, {'calls': 0, 'wall': 0.0, 'cpu': 0.0})
+            total['calls'] += 1
+            total['wall'] += wall
+            total['cpu'] += cpu
+
+    def as_dict(self):
+        '''the totals per stage, and per app and stage, ready for JSON'''
+        result = {'stages': dict(), 'apps': dict()}
+        for (name, app), total in self.totals.items():
+            if app is None:
+                result['stages'][name] = total
+            else:
+                result['apps'].setdefault(app, dict())[name] = total
+        return result
+
+
+class MemoryReport():
+    '''
+    A hook that measures the memory allocated by each parse, write and
+    merge, per app: the peak while it ran, what was still allocated when it
+    finished, and the top allocation sites.  Without tracemalloc, only the
+    growth of the process's maximum resident size can be reported.
+    '''
+
+    measured = ('parse', 'write', 'merge')
+
+    def __init__(self, top=10):
+        self.top = top
+        self.report = dict()
+        self._started = []
+        self._tracing = False
+        if tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+
+    def close(self):
+        '''stop tracing, if this started it'''
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+    @staticmethod
+    def _maxrss():
+        if resource is None:
+            return None
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            return maxrss # already in bytes
+        return maxrss * 1024
+
+    def __call__(self, event, name, app):
+        if name not in self.measured:
+            return
+        if event == 'start':
+            if tracemalloc and tracemalloc.is_tracing():
+                if hasattr(tracemalloc, 'reset_peak'): # python >= 3.9
+                    tracemalloc.reset_peak()
+                self._started.append((tracemalloc.take_snapshot(),
+                                      tracemalloc.get_traced_memory()[0]))
+            else:
+                self._started.append((None, self._maxrss()))
+            return
+
+        snapshot, before = self._started.pop()
+        entry = self.report.setdefault(app or '(all)', dict()).setdefault(
+            name, {'calls': 0, 'peak_bytes': 0, 'retained_bytes': 0, 'top': []})
+        entry['calls'] += 1
+        if snapshot is None:
+            after = self._maxrss()
+            if before is not None and after is not None:
+                entry['peak_bytes'] = max(entry['peak_bytes'], after - before)
+            entry['retained_bytes'] = None
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        entry['peak_bytes'] = max(entry['peak_bytes'], peak - before)
+        entry['retained_bytes'] += current - before
+        ignore = (tracemalloc.Filter(False, tracemalloc.__file__),
+                  tracemalloc.Filter(False, __file__))
+        stats = tracemalloc.take_snapshot().filter_traces(ignore).compare_to(
+            snapshot.filter_traces(ignore), 'lineno')
+        entry['top'] = [{'site': '%s:%d' % (stat.traceback[0].filename, stat.traceback[0].lineno),
+                         'size_bytes': stat.size_diff,
+                         'count': stat.count_diff}
+                        for stat in stats[:self.top] if stat.size_diff > 0]
+
+    def as_dict(self):
+        '''the report per app and stage, ready for JSON'''
+        return {'tracemalloc': tracemalloc is not None, 'apps': self.report}
+
+
+#------------------------------------------------------------------------------#
+# for testing from the command line:
+def main(argv):
+    import json
+
+    timer = StageTimer()
+    add_hook(timer)
+    with stage('parse', 'pidgin'):
+        with stage('fingerprint'):
+            sum(range(100000))
+    with stage('merge'):
+        pass
+    remove_hook(timer)
+    print(json.dumps(timer.as_dict(), indent=2, sort_keys=True))
+
+    memory = MemoryReport(top=3)
+    add_hook(memory)
+    with stage('parse', 'pidgin'):
+        retained = [str(i) for i in range(10000)]
+    remove_hook(memory)
+    memory.close()
+    print(json.dumps(memory.as_dict(), indent=2, sort_keys=True))
+    print('retained %d strings while parsing' % len(retained))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -23,46 +23,74 @@ format that is commonly used for OTR keys.
 
 from __future__ import print_function
 import base64
+import binascii
+import functools
+import glob
 import math
 import os
-import psutil
 import re
+import shutil
 import signal
+import struct
 import sys
 import tempfile
+import threading
+import time
 try:
     # Import hashlib if Python >= 2.5
     from hashlib import sha1
     assert sha1 # silence pyflakes
 except ImportError:
     from sha import sha as sha1
-
-from pyasn1.codec.der import decoder
-from pyasn1.codec.der import encoder
-from pyasn1.type import univ
-
-from potr.utils import bytes_to_long
-from potr.compatcrypto import DSAKey
+try:
+    long
+except NameError: # python 3 only has int
+    long = int
+try:
+    from collections.abc import Mapping
+except ImportError: # python 2
+    from collections import Mapping
 
 if __name__ == '__main__':
     sys.path.insert(0, "../") # so the main() test suite can find otrapps module
 import otrapps.errors as errors
+import otrapps.metrics as metrics
+import otrapps.stages as stages
 
 
 # gracefully handle it when pymtp doesn't exist
 class MTPDummy():
     def detect_devices(self):
         return []
-try:
-    import pymtp
-    mtp = pymtp.MTP()
-except:
-    mtp = MTPDummy()
-# GNOME GVFS mount point for MTP devices
 
-if sys.platform != 'win32':
-    # this crashes windows in the ntpath sys lib
-    mtp.gvfs_mountpoint = os.path.join(os.getenv('HOME'), '.gvfs', 'mtp')
+_mtp = None
+
+def get_mtp():
+    '''setting up pymtp probes for devices, so only do it when first needed'''
+    global _mtp
+    if _mtp is None:
+        try:
+            import pymtp
+            _mtp = pymtp.MTP()
+        except:
+            _mtp = MTPDummy()
+    return _mtp
+
+
+def get_gvfs_mountpoint():
+    '''GNOME GVFS mount point for MTP devices, there is none on Windows'''
+    if sys.platform == 'win32':
+        # this crashes windows in the ntpath sys lib
+        return None
+    return os.path.join(os.path.expanduser('~'), '.gvfs', 'mtp')
+
+
+def _pyasn1():
+    '''pyasn1 is only needed by the otr4j-style formats, so load it on demand'''
+    from pyasn1.codec.der import decoder
+    from pyasn1.codec.der import encoder
+    from pyasn1.type import univ
+    return decoder, encoder, univ
 
 
 HLEN = sha1().digest_size  # length of the hash output
@@ -79,14 +107,17 @@ HLEN = sha1().digest_size  # length of the hash output
 #  coefficient INTEGER -- (inverse of q) mod p }
 #
 #Version ::= INTEGER
-RSA_OID = univ.ObjectIdentifier('1.2.840.113549.1.1.1')
+#
+# the OIDs are kept as strings since pyasn1 is only loaded on demand
+RSA_OID = '1.2.840.113549.1.1.1'
 RSA_PARAMS = ['n', 'e', 'd', 'p', 'q', 'dp', 'dq', 'invq']
-DSA_OID = univ.ObjectIdentifier('1.2.840.10040.4.1')
+DSA_OID = '1.2.840.10040.4.1'
 DSA_PARAMS = ['p', 'q', 'g']  # only algorithm params, not public/private keys
-SHA1RSA_OID = univ.ObjectIdentifier('1.2.840.113549.1.1.5')
-SHA1_OID = univ.ObjectIdentifier('1.3.14.3.2.26')
+SHA1RSA_OID = '1.2.840.113549.1.1.5'
+SHA1_OID = '1.3.14.3.2.26'
 
 def ASN1Sequence(*vals):
+    decoder, encoder, univ = _pyasn1()
     seq = univ.Sequence()
     for i in range(len(vals)):
         seq.setComponentByPosition(i, vals[i])
@@ -110,6 +141,7 @@ def ParseASN1Sequence(seq):
 #
 #Attributes ::= SET OF Attribute
 def ParsePkcs8(pkcs8):
+    decoder, encoder, univ = _pyasn1()
     seq = ParseASN1Sequence(decoder.decode(Decode(pkcs8))[0])
     if len(seq) != 3:  # need three fields in PrivateKeyInfo
         raise errors.KeyczarError("Illegal PKCS8 String.")
@@ -120,14 +152,14 @@ def ParsePkcs8(pkcs8):
     key = decoder.decode(seq[2])[0]
     # Component 2 is an OCTET STRING which is further decoded
     params = {}
-    if oid == RSA_OID:
+    if oid == univ.ObjectIdentifier(RSA_OID):
         key = ParseASN1Sequence(key)
         version = int(key[0])
         if version != 0:
             raise errors.KeyczarError("Unrecognized RSA Private Key Version")
         for i in range(len(RSA_PARAMS)):
             params[RSA_PARAMS[i]] = long(key[i+1])
-    elif oid == DSA_OID:
+    elif oid == univ.ObjectIdentifier(DSA_OID):
         alg_params = ParseASN1Sequence(alg_params)
         for i in range(len(DSA_PARAMS)):
             params[DSA_PARAMS[i]] = long(alg_params[i])
@@ -137,7 +169,8 @@ def ParsePkcs8(pkcs8):
     return params
 
 def ExportRsaPkcs8(params):
-    oid = ASN1Sequence(RSA_OID, univ.Null())
+    decoder, encoder, univ = _pyasn1()
+    oid = ASN1Sequence(univ.ObjectIdentifier(RSA_OID), univ.Null())
     key = univ.Sequence().setComponentByPosition(0, univ.Integer(0))  # version
     for i in range(len(RSA_PARAMS)):
         key.setComponentByPosition(i+1, univ.Integer(params[RSA_PARAMS[i]]))
@@ -146,10 +179,11 @@ def ExportRsaPkcs8(params):
     return Encode(encoder.encode(seq))
 
 def ExportDsaPkcs8(params):
+    decoder, encoder, univ = _pyasn1()
     alg_params = univ.Sequence()
     for i in range(len(DSA_PARAMS)):
         alg_params.setComponentByPosition(i, univ.Integer(params[DSA_PARAMS[i]]))
-    oid = ASN1Sequence(DSA_OID, alg_params)
+    oid = ASN1Sequence(univ.ObjectIdentifier(DSA_OID), alg_params)
     octkey = encoder.encode(univ.Integer(params['x']))
     seq = ASN1Sequence(univ.Integer(0), oid, univ.OctetString(octkey))
     return Encode(encoder.encode(seq))
@@ -159,6 +193,7 @@ def ExportDsaPkcs8(params):
 #        algorithm            AlgorithmIdentifier,
 #        subjectPublicKey     BIT STRING  }
 def ParseX509(x509):
+    decoder, encoder, univ = _pyasn1()
     seq = ParseASN1Sequence(decoder.decode(Decode(x509))[0])
     if len(seq) != 2:  # need two fields in SubjectPublicKeyInfo
         raise errors.KeyczarError("Illegal X.509 String.")
@@ -168,9 +203,9 @@ def ParseX509(x509):
     # Component 1 should be a BIT STRING, get raw bits by discarding extra chars,
     # then convert to OCTET STRING which can be ASN.1 decoded
     params = {}
-    if oid == RSA_OID:
+    if oid == univ.ObjectIdentifier(RSA_OID):
         [params['n'], params['e']] = [long(x) for x in ParseASN1Sequence(pubkey)]
-    elif oid == DSA_OID:
+    elif oid == univ.ObjectIdentifier(DSA_OID):
         vals = [long(x) for x in ParseASN1Sequence(alg_params)]
         for i in range(len(DSA_PARAMS)):
             params[DSA_PARAMS[i]] = vals[i]
@@ -180,7 +215,8 @@ def ParseX509(x509):
     return params
 
 def ExportRsaX509(params):
-    oid = ASN1Sequence(RSA_OID, univ.Null())
+    decoder, encoder, univ = _pyasn1()
+    oid = ASN1Sequence(univ.ObjectIdentifier(RSA_OID), univ.Null())
     key = ASN1Sequence(univ.Integer(params['n']), univ.Integer(params['e']))
     binkey = BytesToBin(encoder.encode(key))
     pubkey = univ.BitString("'%s'B" % binkey)  # needs to be a BIT STRING
@@ -188,10 +224,11 @@ def ExportRsaX509(params):
     return Encode(encoder.encode(seq))
 
 def ExportDsaX509(params):
+    decoder, encoder, univ = _pyasn1()
     alg_params = ASN1Sequence(univ.Integer(params['p']),
                               univ.Integer(params['q']),
                               univ.Integer(params['g']))
-    oid = ASN1Sequence(DSA_OID, alg_params)
+    oid = ASN1Sequence(univ.ObjectIdentifier(DSA_OID), alg_params)
     binkey = BytesToBin(encoder.encode(univ.Integer(params['y'])))
     pubkey = univ.BitString("'%s'B" % binkey)  # needs to be a BIT STRING
     seq = ASN1Sequence(oid, pubkey)
@@ -210,6 +247,7 @@ def MakeDsaSig(r, s):
     @return: raw byte string formatted as an ASN.1 sequence of r and s
     @rtype: string
     """
+    decoder, encoder, univ = _pyasn1()
     seq = ASN1Sequence(univ.Integer(r), univ.Integer(s))
     return encoder.encode(seq)
 
@@ -225,6 +263,7 @@ def ParseDsaSig(sig):
 
     @raise KeyczarErrror: if the DSA signature format is invalid
     """
+    decoder, encoder, univ = _pyasn1()
     seq = decoder.decode(sig)[0]
     if len(seq) != 2:
         raise errors.KeyczarError("Illegal DSA signature.")
@@ -243,13 +282,15 @@ def MakeEmsaMessage(msg, modulus_size):
 def BinToBytes(bits):
     """Convert bit string to byte string."""
     bits = _PadByte(bits)
-    octets = [bits[8*i:8*(i+1)] for i in range(len(bits)/8)]
-    bytes = [chr(int(x, 2)) for x in octets]
-    return "".join(bytes)
+    if not bits:
+        return b''
+    return binascii.unhexlify('%0*x' % (len(bits) // 4, int(bits, 2)))
 
 def BytesToBin(bytes):
     """Convert byte string to bit string."""
-    return "".join([_PadByte(IntToBin(ord(byte))) for byte in bytes])
+    if not bytes:
+        return ''
+    return IntToBin(BytesToLong(bytes)).zfill(len(bytes) * 8)
 
 def _PadByte(bits):
     """Pad a string of bits with zeros to make its length a multiple of 8."""
@@ -257,43 +298,33 @@ def _PadByte(bits):
     return ((8-r) % 8)*'0' + bits
 
 def IntToBin(n):
-    if n == 0 or n == 1:
-        return str(n)
-    elif n % 2 == 0:
-        return IntToBin(n/2) + "0"
-    else:
-        return IntToBin(n/2) + "1"
+    return '{0:b}'.format(n)
+
+def _LongToBytes(n, length):
+    """Return n as exactly length big-endian bytes."""
+    if length == 0:
+        return b''
+    return binascii.unhexlify('%0*x' % (length * 2, n))
 
 def BigIntToBytes(n):
     """Return a big-endian byte string representation of an arbitrary length n."""
-    chars = []
-    while (n > 0):
-        chars.append(chr(n % 256))
-        n = n >> 8
-    chars.reverse()
-    return "".join(chars)
+    if n <= 0:
+        return b''
+    return _LongToBytes(n, (n.bit_length() + 7) // 8)
 
 def IntToBytes(n):
     """Return byte string of 4 big-endian ordered bytes representing n."""
-    bytes = [m % 256 for m in [n >> 24, n >> 16, n >> 8, n]]
-    return "".join([chr(b) for b in bytes])  # byte array to byte string
+    return struct.pack('>I', n & 0xFFFFFFFF)
 
 def BytesToLong(bytes):
-    l = len(bytes)
-    return long(sum([ord(bytes[i]) * 256**(l - 1 - i) for i in range(l)]))
+    if not bytes:
+        return long(0)
+    return long(binascii.hexlify(bytes), 16)
 
 def Xor(a, b):
     """Return a ^ b as a byte string where a and b are byte strings."""
-    # pad shorter byte string with zeros to make length equal
-    m = max(len(a), len(b))
-    if m > len(a):
-        a = PadBytes(a, m - len(a))
-    elif m > len(b):
-        b = PadBytes(b, m - len(b))
-    x = [ord(c) for c in a]
-    y = [ord(c) for c in b]
-    z = [chr(x[i] ^ y[i]) for i in range(m)]
-    return "".join(z)
+    # the shorter byte string is padded with zeros to make length equal
+    return _LongToBytes(BytesToLong(a) ^ BytesToLong(b), max(len(a), len(b)))
 
 def PadBytes(bytes, n):
     """Prepend a byte string with n zero bytes."""
@@ -417,15 +448,16 @@ def MGF(seed, mlen):
     """
     if mlen > 2**32 * HLEN:
         raise errors.KeyczarError("MGF1 mask length too long.")
-    output = ""
-    for i in range(int(math.ceil(mlen / float(HLEN)))):
-        output += Hash(seed, IntToBytes(i))
-    return output[:mlen]
+    count = int(math.ceil(mlen / float(HLEN)))
+    return b''.join([Hash(seed, IntToBytes(i)) for i in range(count)])[:mlen]
 
 
 def fingerprint(key):
     '''generate the human readable form of the fingerprint as used in OTR'''
-    return '{0:040x}'.format(bytes_to_long(DSAKey(key).fingerprint()))
+    from potr.utils import bytes_to_long
+    from potr.compatcrypto import DSAKey
+    with stages.stage('fingerprint'):
+        return '{0:040x}'.format(bytes_to_long(DSAKey(key).fingerprint()))
 
 
 def check_and_set(key, k, v):
@@ -440,6 +472,7 @@ def check_and_set(key, k, v):
                 name = key['name']
             else:
                 name = '(unknown)'
+            metrics.merge_conflicts.inc(field=k)
             # this should be an Exception so that the GUI can catch it to handle it
             print('"' + k + '" values for "' + name + '" did not match: \n\t"' + str(key[k])
                             + '" != "' + str(v) + '"')
@@ -463,8 +496,70 @@ def merge_keydicts(kd1, kd2):
             kd1[name] = key
 
 
+class KeyView(Mapping):
+    '''a read-only view of one key, with some of its values replaced'''
+
+    __slots__ = ('_key', '_overlay')
+
+    def __init__(self, key, overlay):
+        self._key = key
+        self._overlay = overlay
+
+    def __getitem__(self, k):
+        if k in self._overlay:
+            return self._overlay[k]
+        return self._key[k]
+
+    def __contains__(self, k):
+        return k in self._key
+
+    def __iter__(self):
+        return iter(self._key)
+
+    def __len__(self):
+        return len(self._key)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class KeydictView(Mapping):
+    '''
+    A read-only view of a merged keydict for the writers.  Each writer can
+    give translation maps for the values it names differently, i.e. Kopete's
+    protocol names or Adium's account index numbers, which are applied as the
+    keys are looked up.  So many outputs can be written from the one keydict
+    without copying it, and no writer can change what the next one sees.
+    '''
+
+    def __init__(self, keydict, **translations):
+        self._keydict = keydict
+        self._translations = [(field, table) for field, table in translations.items() if table]
+
+    def __getitem__(self, name):
+        key = self._keydict[name]
+        overlay = dict()
+        for field, table in self._translations:
+            if field in key and key[field] in table:
+                overlay[field] = table[key[field]]
+        return KeyView(key, overlay)
+
+    def __contains__(self, name):
+        return name in self._keydict
+
+    def __iter__(self):
+        return iter(self._keydict)
+
+    def __len__(self):
+        return len(self._keydict)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
 def _get_pids():
     '''python-psutil's API changed in v3.0'''
+    import psutil
     try:
         return psutil.pids()  # v3.0+
     except AttributeError:
@@ -476,6 +571,7 @@ def which_apps_are_running(apps):
     Check the process list to see if any of the specified apps are running.
     It returns a tuple of running apps.
     '''
+    import psutil
     running = []
     for pid in _get_pids():
         try:
@@ -504,6 +600,7 @@ def killall(app):
     '''
     terminates all instances of an app
     '''
+    import psutil
     for pid in _get_pids():
         p = psutil.Process(pid)
         if app == p.name:
@@ -522,15 +619,165 @@ def killall(app):
                 pass
 
 
-def _fullcopy(src, dst):
+COPY_CHUNK_SIZE = 1024 * 1024 # MTP-over-FUSE is much faster with big writes
+
+
+def map_threads(func, items, threads=8):
     '''
-    A simple full file copy that ignores perms, since MTP doesn't play well
-    with them.  shutil.copy() tries to dup perms...
+    Like map(), but runs func on up to threads of the items at once, for
+    work that mostly waits on disks or devices.  The results are in the
+    order of items.  If func raised, the first exception is raised once
+    all of the threads are done.
     '''
-    with open(src) as f:
-        content = f.readlines()
-    with open(dst, 'w') as f:
-        f.writelines(content)
+    items = list(items)
+    threads = min(threads, len(items))
+    if threads <= 1:
+        return [func(item) for item in items]
+    results = [None] * len(items)
+    failures = []
+    todo = iter(enumerate(items))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                try:
+                    i, item = next(todo)
+                except StopIteration:
+                    return
+            try:
+                results[i] = func(item)
+            except Exception as e:
+                failures.append(e)
+
+    workers = [threading.Thread(target=worker) for i in range(threads)]
+    for t in workers:
+        t.daemon = True
+        t.start()
+    for t in workers:
+        t.join()
+    if failures:
+        raise failures[0]
+    return results
+
+
+def _file_digest(filename, length=None):
+    '''SHA-1 of the first length bytes of a file, or the whole file'''
+    md = sha1()
+    remaining = length
+    with open(filename, 'rb') as f:
+        while remaining is None or remaining > 0:
+            if remaining is None:
+                chunk = f.read(COPY_CHUNK_SIZE)
+            else:
+                chunk = f.read(min(COPY_CHUNK_SIZE, remaining))
+                remaining -= len(chunk)
+            if not chunk:
+                break
+            md.update(chunk)
+    return md.digest()
+
+
+def _kernel_copy(fsrc, fdst, offset, count):
+    '''
+    Let the kernel move the bytes with copy_file_range() or sendfile() when
+    this python has them.  Returns None if neither is available or usable on
+    this pair of files, e.g. on a FUSE mount, so the caller falls back.
+    '''
+    infd = fsrc.fileno()
+    outfd = fdst.fileno()
+    for name in ('copy_file_range', 'sendfile'):
+        func = getattr(os, name, None)
+        if func is None:
+            continue
+        try:
+            if name == 'copy_file_range':
+                return func(infd, outfd, count, offset, offset)
+            os.lseek(outfd, offset, os.SEEK_SET)
+            return func(outfd, infd, offset, count)
+        except (OSError, IOError):
+            continue
+    return None
+
+
+def copy_file(src, dst, callback=None, verify=True, resume=True):
+    '''
+    Copy src to dst in large binary chunks, ignoring perms since MTP doesn't
+    play well with them.  shutil.copy() tries to dup perms...  If dst holds
+    the beginning of src from an interrupted copy, the copy resumes from
+    there.  callback(sent, total, bytes_per_second) is called after each
+    chunk.  With verify, dst is read back and its checksum compared to src.
+    Returns the number of bytes that were actually transferred.
+    '''
+    total = os.path.getsize(src)
+    offset = 0
+    if resume and os.path.isfile(dst):
+        existing = os.path.getsize(dst)
+        if 0 < existing < total \
+                and _file_digest(dst) == _file_digest(src, existing):
+            offset = existing
+
+    start = time.time()
+    sent = offset
+    use_kernel = True
+    with open(src, 'rb') as fsrc:
+        with open(dst, 'r+b' if offset else 'wb') as fdst:
+            fsrc.seek(offset)
+            fdst.seek(offset)
+            while sent < total:
+                count = min(COPY_CHUNK_SIZE, total - sent)
+                n = None
+                if use_kernel:
+                    fdst.flush()
+                    n = _kernel_copy(fsrc, fdst, sent, count)
+                    if n:
+                        fsrc.seek(sent + n)
+                        fdst.seek(sent + n)
+                    else:
+                        use_kernel = False
+                if not n:
+                    chunk = fsrc.read(count)
+                    if not chunk:
+                        break
+                    fdst.write(chunk)
+                    n = len(chunk)
+                sent += n
+                if callback:
+                    elapsed = time.time() - start
+                    if elapsed > 0:
+                        rate = (sent - offset) / elapsed
+                    else:
+                        rate = 0.0
+                    callback(sent, total, rate)
+            fdst.truncate(sent)
+
+    if verify and _file_digest(dst) != _file_digest(src):
+        raise IOError('Copying "' + src + '" to "' + dst + '" failed verification!')
+    return sent - offset
+
+
+class ProgressThrottle():
+    '''
+    Wraps a callback(sent, total, bytes_per_second) so it is called at most
+    once per interval seconds, i.e. so a GUI is not redrawn for every chunk.
+    The first and the last call always go through.  Any args before sent,
+    i.e. callback(device, sent, total, bytes_per_second), are throttled
+    separately, so each device gets its own updates.
+    '''
+
+    def __init__(self, callback, interval=0.1):
+        self.callback = callback
+        self.interval = interval
+        self._last = dict()
+
+    def __call__(self, *args):
+        key = args[:-3]
+        sent, total = args[-3], args[-2]
+        now = time.time()
+        last = self._last.get(key)
+        if last is None or sent >= total or now - last >= self.interval:
+            self._last[key] = now
+            self.callback(*args)
 
 
 def make_conffile_backup(filename):
@@ -538,35 +785,288 @@ def make_conffile_backup(filename):
     realpath = os.path.realpath(filename) # eliminate symlinks
     s = os.stat(realpath)
     timestamp = s.st_mtime
-    _fullcopy(realpath, realpath + '.' +  str(timestamp))
+    copy_file(realpath, realpath + '.' +  str(timestamp), resume=False)
+
+
+# when set, i.e. by keysync --dry-run, the outputs are rendered but not written
+dry_run = False
+# (filename, status, size) of each output since the last clear, status is one
+# of 'new', 'changed' or 'unchanged', size is the size of what was rendered
+output_log = []
+
+
+def _strip_comments(data, prefix):
+    return b'\n'.join(line for line in data.split(b'\n') if not line.startswith(prefix))
+
+
+def _same_content(filename, data, comment=None):
+    '''check the size first, so most changes are found without reading the file'''
+    try:
+        size = os.path.getsize(filename)
+    except OSError:
+        return False
+    if size == len(data) and _file_digest(filename) == sha1(data).digest():
+        return True
+    if comment is None:
+        return False
+    with open(filename, 'rb') as f:
+        existing = f.read()
+    return _strip_comments(existing, comment) == _strip_comments(data, comment)
+
+
+def save_output(filename, data, binary=False, comment=None):
+    '''
+    Write data to filename, unless the file already has exactly that
+    content, so that unchanged files keep their mtime and running apps do
+    not reload them.  Lines starting with comment are not compared, for
+    files that have a timestamp in them.  Returns the status of the file.
+    '''
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    if not binary and os.linesep != '\n':
+        data = data.replace(b'\n', os.linesep.encode('ascii'))
+    if comment is not None and not isinstance(comment, bytes):
+        comment = comment.encode('utf-8')
+    if not os.path.exists(filename):
+        status = 'new'
+    elif _same_content(filename, data, comment):
+        status = 'unchanged'
+    else:
+        status = 'changed'
+    output_log.append((filename, status, len(data)))
+    if status != 'unchanged' and not dry_run:
+        with open(filename, 'wb') as f:
+            f.write(data)
+    return status
+
+
+class OutputFile():
+    '''
+    A file-like object for the writers to render an output into, which is
+    only saved by save_output() when it is closed.
+    '''
+
+    def __init__(self, filename, binary=False, comment=None):
+        self.name = filename
+        self.mode = 'w'
+        if binary:
+            self.mode = 'wb'
+        self.binary = binary
+        self.comment = comment
+        self.closed = False
+        self.status = None
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        if self.binary:
+            return b''.join(self._chunks)
+        return ''.join(self._chunks)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.status = save_output(self.name, self.getvalue(), self.binary, self.comment)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.closed = True # leave the existing file alone
+
+
+
+def _get_umask():
+    '''os.umask() can only be read by setting it, so only do that once'''
+    global _umask
+    with _umask_lock:
+        if _umask is None:
+            _umask = os.umask(0o022)
+            os.umask(_umask)
+    return _umask
+
+_umask = None
+_umask_lock = threading.Lock()
+
+
+class SpooledOutputFile(OutputFile):
+    '''
+    Like OutputFile, but what is written goes straight to a temp file next to
+    filename, so that a streamed output never has to be held in memory.  When
+    it is closed, the temp file replaces filename, unless they are the same.
+    The result gets the same mode that OutputFile would give it.
+    '''
+
+    def __init__(self, filename, binary=False):
+        OutputFile.__init__(self, filename, binary)
+        self._newmode = 0o666 & ~_get_umask()
+        # in the same folder, so the temp file can be renamed into place
+        folder = os.path.dirname(os.path.abspath(filename))
+        if dry_run:
+            folder = None # nothing will be written there
+        fd, self._tmpname = tempfile.mkstemp(dir=folder, prefix='.' + os.path.basename(filename))
+        self._tmp = os.fdopen(fd, 'wb')
+        self._digest = sha1()
+        self._size = 0
+
+    def write(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        if not self.binary and os.linesep != '\n':
+            data = data.replace(b'\n', os.linesep.encode('ascii'))
+        self._tmp.write(data)
+        self._digest.update(data)
+        self._size += len(data)
+
+    def getvalue(self):
+        self._tmp.flush()
+        with open(self._tmpname, 'rb') as f:
+            return f.read()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._tmp.close()
+        if not os.path.exists(self.name):
+            self.status = 'new'
+        elif (os.path.getsize(self.name) == self._size
+              and _file_digest(self.name) == self._digest.digest()):
+            self.status = 'unchanged'
+        else:
+            self.status = 'changed'
+        output_log.append((self.name, self.status, self._size))
+        if self.status == 'unchanged' or dry_run:
+            os.remove(self._tmpname)
+            return
+        if self.status == 'changed':
+            shutil.copymode(self.name, self._tmpname)
+            if sys.platform == 'win32':
+                os.remove(self.name) # rename cannot replace on Windows
+        else:
+            # mkstemp() makes it 0600, open() would use the umask
+            os.chmod(self._tmpname, self._newmode)
+        os.rename(self._tmpname, self.name)
+
+    def abort(self):
+        '''throw away what was written, leaving the existing file alone'''
+        if not self.closed:
+            self.closed = True
+            self._tmp.close()
+            os.remove(self._tmpname)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def diff_keydicts(old, new):
+    '''
+    Compare what an app has now with what keysync would write, returns a
+    sorted list of (name, kind, change, detail), where kind is 'account'
+    for keys with a private key, otherwise 'key'.
+    '''
+    changes = []
+    for name in set(old.keys()) | set(new.keys()):
+        o = old.get(name)
+        n = new.get(name)
+        kind = 'account'
+        if 'x' not in (n or o):
+            kind = 'key'
+        if o is None:
+            changes.append((name, kind, 'added', n.get('fingerprint', '')))
+        elif n is None:
+            changes.append((name, kind, 'removed', o.get('fingerprint', '')))
+        else:
+            if o.get('fingerprint') != n.get('fingerprint'):
+                changes.append((name, kind, 'fingerprint',
+                                '%s -> %s' % (o.get('fingerprint'), n.get('fingerprint'))))
+            if o.get('x') != n.get('x'):
+                changes.append((name, kind, 'private key', ''))
+            if (o.get('verification') or '') != (n.get('verification') or ''):
+                changes.append((name, kind, 'verification',
+                                '%r -> %r' % (o.get('verification') or '', n.get('verification') or '')))
+    return sorted(changes)
+
+
+def gvfs_dirs():
+    '''
+    The folders where gvfs mounts MTP devices.  Older gvfs mounts one
+    device at ~/.gvfs/mtp, newer gvfs mounts each as its own mtp:host=...
+    folder in ~/.gvfs or $XDG_RUNTIME_DIR/gvfs.  Unlike the pymtp probe,
+    checking these is cheap.
+    '''
+    mountpoint = get_gvfs_mountpoint()
+    if mountpoint is None:
+        return []
+    dirs = [mountpoint, os.path.dirname(mountpoint)]
+    runtime = os.getenv('XDG_RUNTIME_DIR')
+    if runtime:
+        dirs.append(os.path.join(runtime, 'gvfs'))
+    return dirs
+
+
+def find_gvfs_mountpoints():
+    '''every MTP device that gvfs has mounted'''
+    dirs = gvfs_dirs()
+    mountpoints = []
+    if dirs and os.path.isdir(dirs[0]):
+        mountpoints.append(dirs[0])
+    for gvfsdir in dirs[1:]:
+        for mountpoint in sorted(glob.glob(os.path.join(gvfsdir, 'mtp:*'))):
+            if os.path.isdir(mountpoint):
+                mountpoints.append(mountpoint)
+    return mountpoints
+
+
+def _find_storage_dir(mountpoint):
+    '''find the MTP subfolder of a device's mount to copy the keystore to'''
+    for name in ('Internal storage', 'SD card'):
+        if os.path.isdir(os.path.join(mountpoint, name)):
+            return os.path.join(mountpoint, name)
+    # if no standard names, try the first dir we find
+    for f in sorted(os.listdir(mountpoint)):
+        fp = os.path.join(mountpoint, f)
+        if os.path.isdir(fp):
+            return fp
+
+
+def find_gvfs_destdirs():
+    '''find the MTP subfolder in gvfs to copy the keystore to, for every device'''
+    destdirs = []
+    for mountpoint in find_gvfs_mountpoints():
+        try:
+            destdir = _find_storage_dir(mountpoint)
+        except OSError:
+            continue # i.e. unplugged while looking
+        if destdir:
+            destdirs.append(destdir)
+    return destdirs
 
 
 def find_gvfs_destdir():
     '''find the MTP subfolder in gvfs to copy the keystore to'''
-    if os.path.exists(mtp.gvfs_mountpoint):
-        foundit = False
-        # this assumes that gvfs is mounting the MTP device
-        if os.path.isdir(os.path.join(mtp.gvfs_mountpoint, 'Internal storage')):
-            mtpdir = os.path.join(mtp.gvfs_mountpoint, 'Internal storage')
-            foundit = True
-        elif os.path.isdir(os.path.join(mtp.gvfs_mountpoint, 'SD card')):
-            mtpdir = os.path.join(mtp.gvfs_mountpoint, 'SD card')
-            foundit = True
-        else:
-            # if no standard names, try the first dir we find
-            files = os.listdir(mtp.gvfs_mountpoint)
-            if len(files) > 0:
-                for f in files:
-                    fp = os.path.join(mtp.gvfs_mountpoint, f)
-                    if os.path.isdir(fp):
-                        mtpdir = fp
-                        foundit = True
-        if foundit:
-            return mtpdir
+    destdirs = find_gvfs_destdirs()
+    if destdirs:
+        return destdirs[0]
 
 
 def can_sync_to_device():
     '''checks if an MTP device is mounted, i.e. an Android 4.x device'''
+    mtp = get_mtp()
     mtp.devicename = ''
     if sys.platform == 'win32':
         # Right now the win32 'sync' method is to prompt the user to manually
@@ -603,8 +1103,139 @@ def get_keystore_savedir():
     return tempfile.mkdtemp(prefix='.keysync-')
 
 
-def sync_file_to_device(filename):
-    '''sync the keystore file to the device via whatever the relevant method is'''
+def get_cache_dir(subdir):
+    '''a folder that only this user can read, for keysync's caches'''
+    if sys.platform == 'win32':
+        base = os.getenv('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    cachedir = os.path.join(base, 'keysync', subdir)
+    if not os.path.exists(cachedir):
+        os.makedirs(cachedir, 0o700)
+    os.chmod(cachedir, 0o700)
+    return cachedir
+
+
+def write_private_file(filename, data):
+    '''write data to filename so only this user can read it, replacing it whole'''
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    tmpname = filename + '.tmp'
+    fd = os.open(tmpname, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    if sys.platform == 'win32' and os.path.exists(filename):
+        os.remove(filename) # rename cannot replace on Windows
+    os.rename(tmpname, filename)
+
+
+def sync_file_to_device(filename, destdir=None, callback=None, connected=False):
+    '''
+    sync the keystore file to the device via whatever the relevant method is.
+    destdir is the folder on a gvfs-mounted device, otherwise pymtp is used.
+    callback(sent, total, bytes_per_second) is called as the transfer runs.
+    With connected, the caller already connected pymtp, and disconnects it.
+    Returns 'sent', or 'unchanged' if the device already had the same file.
+    '''
+    with stages.stage('sync'):
+        status = _sync_file_to_device(filename, destdir, callback, connected)
+    _count_sync(filename, [status])
+    return status
+
+
+def _count_sync(filename, statuses):
+    metrics.device_bytes.inc(os.path.getsize(filename) * statuses.count('sent'))
+    metrics.device_skips.inc(statuses.count('unchanged'))
+
+
+def sync_file_to_devices(filename, destdirs, callback=None):
+    '''
+    Copy the keystore to each of the gvfs-mounted destdirs at once, so it
+    takes about as long as the slowest device.  callback(destdir, sent,
+    total, bytes_per_second) reports each device's progress.  A failure on
+    one device does not stop the others, so this returns a list of
+    (destdir, status, exception or None), where status is 'sent',
+    'unchanged' or 'failed'.
+    '''
+    def sync_one(destdir):
+        device_callback = None
+        if callback:
+            device_callback = functools.partial(callback, destdir)
+        try:
+            return destdir, _sync_file_to_device(filename, destdir, device_callback), None
+        except Exception as e:
+            return destdir, 'failed', e
+
+    # the stages are not thread-safe, so one for all of the devices
+    with stages.stage('sync'):
+        results = map_threads(sync_one, destdirs, max(len(destdirs), 1))
+    _count_sync(filename, [status for destdir, status, e in results])
+    return results
+
+
+def same_file(src, dst):
+    '''check the size first, so a changed file is found without reading dst'''
+    try:
+        if os.path.getsize(src) != os.path.getsize(dst):
+            return False
+    except OSError:
+        return False
+    return _file_digest(src) == _file_digest(dst)
+
+
+def _mtp_has_file(mtp, filename, target):
+    '''
+    Whether the device has target with the same content as filename.  The
+    file listing gives the size, and only a file of the same size is read
+    back to compare, which is much quicker than sending it over MTP.
+    '''
+    size = os.path.getsize(filename)
+    for f in mtp.get_filelisting():
+        if f.filename != target or f.filesize != size:
+            continue
+        fd, tmpname = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            mtp.get_file_to_file(f.item_id, tmpname)
+            if same_file(filename, tmpname):
+                return True
+        finally:
+            os.remove(tmpname)
+    return False
+
+
+def _sync_file_to_device(filename, destdir, callback, connected=False):
+    '''returns 'sent', or 'unchanged' without sending if the device has it'''
+    target = os.path.basename(filename)
+    if destdir:
+        if same_file(filename, os.path.join(destdir, target)):
+            return 'unchanged'
+        copy_file(filename, os.path.join(destdir, target), callback=callback)
+        return 'sent'
+    mtp = get_mtp()
+    if isinstance(mtp, MTPDummy):
+        raise Exception('Cannot sync "' + filename + '", pymtp is not available!')
+
+    start = time.time()
+    def _mtp_callback(sent, total):
+        if callback:
+            elapsed = time.time() - start
+            if elapsed > 0:
+                callback(sent, total, sent / elapsed)
+            else:
+                callback(sent, total, 0.0)
+    def _send():
+        if _mtp_has_file(mtp, filename, target):
+            return 'unchanged'
+        mtp.send_file_from_file(filename, target, callback=_mtp_callback)
+        return 'sent'
+    if connected:
+        return _send()
+    mtp.connect()
+    try:
+        return _send()
+    finally:
+        mtp.disconnect()
 
 
 #------------------------------------------------------------------------------#
@@ -674,6 +1305,32 @@ def main(argv):
     merge_keys(keydict3['key'], key5)
     pprint.pprint(keydict3['key'])
 
+    print('\n---------------------------')
+    print('read-only keydict views: ')
+    view = KeydictView(keydict, name={'key4': '4'}, protocol={'prpl-jabber': 'Jabber'})
+    pprint.pprint(dict(view.items()))
+    try:
+        view['key4']['name'] = 'this should break'
+    except TypeError as e:
+        print('TypeError: ', end=' ')
+        print(e)
+    if keydict['key4']['name'] != 'key4' or keydict['key4']['protocol'] != 'prpl-jabber':
+        raise Exception('the keydict was changed through its view!')
+
+    print('\n---------------------------')
+    print('byte and integer codecs: ', end=' ')
+    for n in (0, 1, 255, 256, 2**1024 - 1, 3**2000):
+        data = BigIntToBytes(n)
+        if BytesToLong(data) != n or BytesToLong(BinToBytes(BytesToBin(data))) != n:
+            raise Exception('"' + str(n) + '" did not survive the codecs!')
+        if n and int(IntToBin(n), 2) != n:
+            raise Exception('"' + str(n) + '" did not survive IntToBin!')
+    print(repr(Xor(b'\x0f\xf0', b'\xff')), repr(IntToBytes(258)), len(MGF(b'seed', 50)))
+
+    print('\n---------------------------')
+    print('map on threads: ', end=' ')
+    print(map_threads(lambda x: x * x, range(10), threads=4))
+
     sys.path.insert(0, os.path.abspath('..'))
     import otrapps
     print('\n---------------------------')
@@ -689,10 +1346,35 @@ def main(argv):
     make_conffile_backup(testfile)
     print('Backed up "%s"' % testfile)
 
+    print('\n---------------------------')
+    print('resume an interrupted copy: ')
+    bigfile = os.path.join(tmpdir, 'keysync-util-copy-test')
+    with open(bigfile, 'wb') as f:
+        f.write(os.urandom(COPY_CHUNK_SIZE * 3 + 17))
+    partial = bigfile + '.copy'
+    with open(bigfile, 'rb') as f:
+        data = f.read(COPY_CHUNK_SIZE + 5)
+    with open(partial, 'wb') as f:
+        f.write(data)
+    sent = copy_file(bigfile, partial)
+    print('transferred %d of %d bytes' % (sent, os.path.getsize(bigfile)))
+    calls = []
+    throttle = ProgressThrottle(lambda sent, total, rate: calls.append(sent), interval=60)
+    copy_file(bigfile, bigfile + '.throttled', callback=throttle)
+    print('throttled progress calls: ' + str(calls))
+
+    print('\n---------------------------')
+    print('only write outputs that change: ')
+    outfile = os.path.join(tmpdir, 'keysync-util-output-test')
+    for content in ('#Sun\na=1\n', '#Sun\na=1\n', '#Mon\na=1\n', '#Mon\na=2\n'):
+        with OutputFile(outfile, comment='#') as f:
+            f.write(content)
+        print('%r: %s' % (content, f.status))
+
     if can_sync_to_device():
         print('\n---------------------------')
         print('MTP is mounted here:', end=' ')
-        print(mtp.devicename)
+        print(get_mtp().devicename)
 
 
 
@@ -8,6 +8,7 @@ import sys
 
 if __name__ == '__main__':
     sys.path.insert(0, "../") # so the main() test suite can find otrapps module
+import otrapps.pipeline
 import otrapps.util
 from otrapps.otr_private_key import OtrPrivateKeys
 from otrapps.otr_fingerprints import OtrFingerprints
@@ -36,6 +37,22 @@ class XchatProperties():
 
         return keydict
 
+    @staticmethod
+    def iter_keys(settingsdir=None):
+        '''yield the private keys, then a key for each fingerprint row as it is read'''
+        if settingsdir == None:
+            settingsdir = XchatProperties.path
+
+        kf = os.path.join(settingsdir, XchatProperties.keyfile)
+        if os.path.exists(kf):
+            for key in OtrPrivateKeys.parse(kf).values():
+                yield key
+
+        fpf = os.path.join(settingsdir, XchatProperties.fingerprintfile)
+        if os.path.exists(fpf):
+            for key in OtrFingerprints.iter_records(fpf):
+                yield key
+
     @staticmethod
     def write(keydict, savedir):
         if not os.path.exists(savedir):
@@ -52,6 +69,15 @@ class XchatProperties():
         fpf = os.path.join(savedir, XchatProperties.fingerprintfile)
         OtrFingerprints.write(keydict, fpf, accounts)
 
+    @staticmethod
+    def stream_writer(savedir, private_keys):
+        '''a writer to stream the fingerprints into, see otrapps.pipeline'''
+        if not os.path.exists(savedir):
+            raise Exception('"' + savedir + '" does not exist!')
+        return otrapps.pipeline.LibotrWriter(os.path.join(savedir, XchatProperties.keyfile),
+                                             os.path.join(savedir, XchatProperties.fingerprintfile),
+                                             private_keys)
+
 
 
 if __name__ == '__main__':
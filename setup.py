@@ -27,6 +27,7 @@ if sys.version_info[0] == 2 and sys.version_info[1] < 7:
     dependencies.append('ordereddict')
 
 if sys.platform == 'darwin':
+     import otrapps
      dependencies.append('PIL')
      dependencies.append('pymtp>=0.0.6')
      extra_options = dict(
@@ -37,6 +38,7 @@ if sys.platform == 'darwin':
          options=dict(
              py2app=dict(
                  argv_emulation=True,
+                 includes=otrapps.app_modules(),
                  semi_standalone=False,
                  use_pythonpath=False,
                  site_packages=True,
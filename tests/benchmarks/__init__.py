@@ -0,0 +1 @@
+'''benchmarks for keysync, run each script directly, i.e. ./keystores.py'''
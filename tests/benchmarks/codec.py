@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''check otrapps.util's byte and integer codecs against the old ones, and time them'''
+
+from __future__ import print_function
+import argparse
+import math
+import os
+import random
+import sys
+import timeit
+
+projectbase = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, projectbase)
+import otrapps.util as util
+
+SIZES = (1024, 3072) # bits, DSA and RSA sized numbers
+
+
+#------------------------------------------------------------------------------#
+# the original implementations, which only run on Python 2
+
+def old_BinToBytes(bits):
+    bits = old_PadByte(bits)
+    octets = [bits[8*i:8*(i+1)] for i in range(len(bits)/8)]
+    bytes = [chr(int(x, 2)) for x in octets]
+    return "".join(bytes)
+
+def old_BytesToBin(bytes):
+    return "".join([old_PadByte(old_IntToBin(ord(byte))) for byte in bytes])
+
+def old_PadByte(bits):
+    r = len(bits) % 8
+    return ((8-r) % 8)*'0' + bits
+
+def old_IntToBin(n):
+    if n == 0 or n == 1:
+        return str(n)
+    elif n % 2 == 0:
+        return old_IntToBin(n/2) + "0"
+    else:
+        return old_IntToBin(n/2) + "1"
+
+def old_BigIntToBytes(n):
+    chars = []
+    while (n > 0):
+        chars.append(chr(n % 256))
+        n = n >> 8
+    chars.reverse()
+    return "".join(chars)
+
+def old_IntToBytes(n):
+    bytes = [m % 256 for m in [n >> 24, n >> 16, n >> 8, n]]
+    return "".join([chr(b) for b in bytes])
+
+def old_BytesToLong(bytes):
+    l = len(bytes)
+    return long(sum([ord(bytes[i]) * 256**(l - 1 - i) for i in range(l)]))
+
+def old_Xor(a, b):
+    m = max(len(a), len(b))
+    if m > len(a):
+        a = util.PadBytes(a, m - len(a))
+    elif m > len(b):
+        b = util.PadBytes(b, m - len(b))
+    x = [ord(c) for c in a]
+    y = [ord(c) for c in b]
+    z = [chr(x[i] ^ y[i]) for i in range(m)]
+    return "".join(z)
+
+def old_MGF(seed, mlen):
+    output = ""
+    for i in range(int(math.ceil(mlen / float(util.HLEN)))):
+        output += util.Hash(seed, old_IntToBytes(i))
+    return output[:mlen]
+
+
+#------------------------------------------------------------------------------#
+
+def _random_bytes(rng, n):
+    return bytes(bytearray(rng.getrandbits(8) for i in range(n)))
+
+
+def check(rng, rounds):
+    '''compare the new codecs to the old ones on edge cases and random values'''
+    checked = 0
+
+    def same(name, old, new, *args):
+        expected = old(*args)
+        got = new(*args)
+        if expected != got or type(expected) != type(got):
+            raise Exception('"' + name + '" gave ' + repr(got) + ' instead of '
+                            + repr(expected) + ' for ' + repr(args)[:200])
+
+    numbers = [0, 1, 2, 255, 256, 65535, 2**32 - 1, 2**32, 2**160 - 1]
+    for bits in SIZES:
+        numbers += [2**bits - 1, 2**(bits - 1)]
+    numbers += [rng.getrandbits(rng.choice(SIZES)) for i in range(rounds)]
+    for n in numbers:
+        same('IntToBin', old_IntToBin, util.IntToBin, n)
+        same('BigIntToBytes', old_BigIntToBytes, util.BigIntToBytes, n)
+        same('IntToBytes', old_IntToBytes, util.IntToBytes, n % 2**40)
+        checked += 3
+
+    strings = [b'', b'\x00', b'\x00\x00\x01', b'\xff' * 20]
+    for i in range(rounds):
+        length = rng.choice([1, 7, 20, 32] + [bits // 8 for bits in SIZES])
+        data = _random_bytes(rng, length)
+        if i % 3 == 0:
+            data = b'\x00' * rng.randint(1, 4) + data # leading zero bytes
+        strings.append(data)
+    for data in strings:
+        same('BytesToLong', old_BytesToLong, util.BytesToLong, data)
+        same('BytesToBin', old_BytesToBin, util.BytesToBin, data)
+        same('Xor', old_Xor, util.Xor, data, rng.choice(strings))
+        same('MGF', old_MGF, util.MGF, data, rng.randint(0, 300))
+        checked += 4
+
+    bitstrings = ['', '0', '1', '101', '00000000', '000000001']
+    for i in range(rounds):
+        length = rng.choice([1, 9, 160] + list(SIZES))
+        bitstrings.append(''.join(rng.choice('01') for j in range(length)))
+    for bits in bitstrings:
+        same('BinToBytes', old_BinToBytes, util.BinToBytes, bits)
+        checked += 1
+    return checked
+
+
+def bench(rng, number):
+    '''time each old and new codec on numbers of each size, in microseconds per call'''
+    results = []
+    for bits in SIZES:
+        n = rng.getrandbits(bits) | (1 << (bits - 1))
+        data = util.BigIntToBytes(n)
+        other = _random_bytes(rng, len(data))
+        binary = util.BytesToBin(data)
+        calls = [
+            ('IntToBin', 'f(n)'),
+            ('BigIntToBytes', 'f(n)'),
+            ('BytesToLong', 'f(data)'),
+            ('BytesToBin', 'f(data)'),
+            ('BinToBytes', 'f(binary)'),
+            ('Xor', 'f(data, other)'),
+            ('MGF', 'f(data, len(data))'),
+        ]
+        for name, stmt in calls:
+            row = {'function': name, 'bits': bits}
+            for which, f in (('old', globals().get('old_' + name)), ('new', getattr(util, name))):
+                if which == 'old' and sys.version_info[0] != 2:
+                    continue
+                env = {'f': f, 'n': n, 'data': data, 'other': other, 'binary': binary}
+                row[which] = min(_repeat(stmt, env, number)) / number * 1e6
+            results.append(row)
+    return results
+
+
+def _repeat(stmt, env, number):
+    '''like timeit.repeat(), which only takes globals= in Python 3.5 and newer'''
+    code = compile(stmt, '<bench>', 'eval')
+    times = []
+    for i in range(3):
+        start = timeit.default_timer()
+        for j in range(number):
+            eval(code, env)
+        times.append(timeit.default_timer() - start)
+    return times
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rounds', type=int, default=200,
+                        help='random values to check per codec (default: 200)')
+    parser.add_argument('-n', '--number', type=int, default=200,
+                        help='calls per timing (default: 200)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    rng = random.Random(args.seed)
+
+    # the old IntToBin recurses once per bit, so 3072 bit numbers need more
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 4 * max(SIZES)))
+    if sys.version_info[0] == 2:
+        print('%d checks, the new codecs give the same results as the old ones'
+              % check(rng, args.rounds))
+    else:
+        print('the old codecs only run on Python 2, not checking them')
+
+    print('%-14s %5s %12s %12s %8s' % ('', 'bits', 'old us/call', 'new us/call', 'speedup'))
+    for row in bench(rng, args.number):
+        if 'old' in row:
+            print('%-14s %5d %12.2f %12.2f %7.1fx' % (row['function'], row['bits'], row['old'],
+                                                       row['new'], row['old'] / row['new']))
+        else:
+            print('%-14s %5d %12s %12.2f' % (row['function'], row['bits'], '', row['new']))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''time every app's parser and writer, and the merge, on synthetic profiles'''
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+try:
+    import resource
+except ImportError:
+    resource = None # not on Windows
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None # python < 3.4
+
+import synthetic
+import otrapps
+import otrapps.util
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'keystores-baseline.json')
+
+
+class _Quiet():
+    '''the parsers and writers are chatty, keep that out of the timings'''
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+
+    def __enter__(self):
+        if self.enabled:
+            self.stdout = sys.stdout
+            sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *exc):
+        if self.enabled:
+            sys.stdout.close()
+            sys.stdout = self.stdout
+
+
+def _maxrss():
+    '''the most memory the process has had resident, in bytes'''
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return maxrss # already in bytes
+    return maxrss * 1024
+
+
+# how the peaks are measured, only peaks measured the same way compare
+MEMORY = 'tracemalloc' if tracemalloc else 'maxrss'
+
+
+def measure(func, repeat, quiet=True):
+    '''
+    Returns the result of the last run, the best time, and peak allocation.
+    Without tracemalloc, i.e. on python 2, the peak is how much the maximum
+    resident size grew, like otrapps.stages.MemoryReport reports it, which
+    is 0 when the process had already been that big.
+    '''
+    best = None
+    peak = None
+    for i in range(repeat):
+        if tracemalloc:
+            tracemalloc.start()
+        else:
+            before = _maxrss()
+        with _Quiet(quiet):
+            start = time.time()
+            result = func()
+            elapsed = time.time() - start
+        if tracemalloc:
+            peak = max(peak or 0, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        elif before is not None:
+            peak = max(peak or 0, _maxrss() - before)
+        if best is None or elapsed < best:
+            best = elapsed
+    return result, best, peak
+
+
+def _rate(count, seconds):
+    if seconds > 0:
+        return count / seconds
+    return None
+
+
+def _profile_bytes(profiledir):
+    return sum(os.path.getsize(os.path.join(profiledir, f)) for f in os.listdir(profiledir))
+
+
+def run(apps, accounts, buddies, fingerprints, repeat, workdir, quiet=True):
+    keydict = synthetic.make_keydict(accounts, buddies)
+    results = dict()
+    parsed = []
+    for app in apps:
+        profiledir = os.path.join(workdir, app)
+        otrapps.apps[app] # keep the first import out of the timings
+        synthetic.prepare_profile(app, keydict, profiledir)
+        ignored, write_s, write_peak = measure(
+            lambda: synthetic.write_profile(app, keydict, profiledir), repeat, quiet)
+        synthetic.add_fingerprints(app, profiledir, fingerprints)
+        appkeys, parse_s, parse_peak = measure(
+            lambda: synthetic.parse_profile(app, profiledir), repeat, quiet)
+        parsed.append(appkeys)
+        results[app] = {'keys': len(appkeys),
+                        'bytes': _profile_bytes(profiledir),
+                        'write_s': write_s,
+                        'write_keys_per_s': _rate(len(keydict), write_s),
+                        'write_peak_bytes': write_peak,
+                        'parse_s': parse_s,
+                        'parse_keys_per_s': _rate(len(appkeys), parse_s),
+                        'parse_peak_bytes': parse_peak}
+
+    def merge_all():
+        merged = dict()
+        for appkeys in parsed:
+            otrapps.util.merge_keydicts(merged, appkeys)
+        return merged
+    # the merge puts the same key dicts into merged, so do it only once
+    merged, merge_s, merge_peak = measure(merge_all, 1, quiet)
+    total = sum(len(appkeys) for appkeys in parsed)
+    results['merge'] = {'keys': len(merged),
+                        'merge_s': merge_s,
+                        'merge_keys_per_s': _rate(total, merge_s),
+                        'merge_peak_bytes': merge_peak}
+    return results
+
+
+def compare(results, baseline, tolerance, noise=0.005, peaks=True):
+    '''list the timings and, with peaks, the peaks that got worse than the baseline allows'''
+    regressions = []
+    for name, metrics in sorted(results.items()):
+        if name not in baseline:
+            continue
+        for metric, value in sorted(metrics.items()):
+            old = baseline[name].get(metric)
+            if value is None or old is None:
+                continue
+            if metric.endswith('_s') and not metric.endswith('_per_s'):
+                slack = noise
+            elif metric.endswith('_peak_bytes') and peaks:
+                slack = 4096
+            else:
+                continue
+            if value > old * (1 + tolerance) + slack:
+                regressions.append((name, metric, old, value))
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--accounts', type=int, default=5,
+                        help='accounts with private keys (default: 5)')
+    parser.add_argument('--buddies', type=int, default=200,
+                        help='buddies with fingerprints (default: 200)')
+    parser.add_argument('--fingerprints', type=int, default=1,
+                        help='fingerprints per buddy in libotr files (default: 1)')
+    parser.add_argument('-a', '--app', action='append', choices=sorted(otrapps.apps_supported),
+                        help='only benchmark this app, can be given more than once')
+    parser.add_argument('-n', '--repeat', type=int, default=3,
+                        help='take the best of this many runs (default: 3)')
+    parser.add_argument('-o', '--output', metavar='FILE', default='keystores-results.json',
+                        help='write the results as JSON to FILE (default: keystores-results.json)')
+    parser.add_argument('--baseline', metavar='FILE', default=None,
+                        help='compare against the results in FILE (default: keystores-baseline.json,'
+                        ' if it exists)')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='flag timings this much worse than the baseline (default: 0.25)')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False,
+                        help='show what the parsers and writers print')
+    args = parser.parse_args(argv)
+
+    apps = args.app or sorted(otrapps.apps_supported)
+    workdir = tempfile.mkdtemp(prefix='.keysync-benchmark-')
+    try:
+        results = run(apps, args.accounts, args.buddies, args.fingerprints,
+                      args.repeat, workdir, quiet=not args.verbose)
+    finally:
+        shutil.rmtree(workdir)
+
+    print('%-12s %6s %10s %10s %12s %12s' % ('', 'keys', 'write s', 'parse s',
+                                            'parse keys/s', 'peak bytes'))
+    for app in apps:
+        r = results[app]
+        peak = max(r['write_peak_bytes'], r['parse_peak_bytes'])
+        print('%-12s %6d %10.4f %10.4f %12.0f %12s'
+              % (app, r['keys'], r['write_s'], r['parse_s'],
+                 r['parse_keys_per_s'] or 0, peak))
+    r = results['merge']
+    print('%-12s %6d %10s %10.4f %12.0f %12s'
+          % ('merge', r['keys'], '', r['merge_s'], r['merge_keys_per_s'] or 0,
+             r['merge_peak_bytes']))
+
+    report = {'python': sys.version.split()[0],
+              'apps': apps,
+              'accounts': args.accounts,
+              'buddies': args.buddies,
+              'fingerprints': args.fingerprints,
+              'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+              'memory': MEMORY,
+              'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print('\nwrote ' + args.output)
+
+    baselinefile = args.baseline or DEFAULT_BASELINE
+    if not os.path.exists(baselinefile):
+        if args.baseline:
+            print('ERROR: there is no baseline "' + args.baseline + '" to compare against!')
+            sys.exit(1)
+        # the timings depend on the machine, so each one needs its own
+        print('\n' + '#' * 72)
+        print('WARNING: NOT CHECKED FOR REGRESSIONS, there is no baseline yet.  Make one')
+        print('on this machine from a known good run with:')
+        print('    cp ' + args.output + ' ' + DEFAULT_BASELINE)
+        print('#' * 72)
+        return
+    with open(baselinefile) as f:
+        baseline = json.load(f)
+    for setting in ('apps', 'accounts', 'buddies', 'fingerprints'):
+        if baseline.get(setting) != report[setting]:
+            print('WARNING: baseline was run with %s=%s' % (setting, baseline.get(setting)))
+    # tracemalloc and maxrss peaks are not the same thing
+    peaks = baseline.get('memory') == MEMORY
+    if not peaks:
+        print('WARNING: baseline measured memory with %s, not comparing the peaks'
+              % baseline.get('memory'))
+    regressions = compare(results, baseline['results'], args.tolerance, peaks=peaks)
+    for name, metric, old, new in regressions:
+        print('REGRESSION %s %s: %s -> %s' % (name, metric, old, new))
+    if regressions:
+        sys.exit(1)
+    print('no regressions against ' + baselinefile)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
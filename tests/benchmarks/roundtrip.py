@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''convert every app to every other app and back in process, checking and timing each pair'''
+
+from __future__ import print_function
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import synthetic
+import otrapps
+
+# the values that mean the same thing whichever app a key came from
+KEY_FIELDS = ('p', 'q', 'g', 'y', 'x')
+
+# keysync cannot write GnuPG keyrings, so it is only ever read
+READERS = sorted(otrapps.apps_supported)
+WRITERS = sorted(app for app in otrapps.apps_supported if app != 'gnupg')
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'roundtrip-baseline.json')
+
+
+def _verified(key):
+    return bool(key.get('verification'))
+
+
+def compare(expected, got):
+    '''
+    Compare two keydicts by what the keys mean rather than how each app
+    stores them, i.e. the protocol names differ from app to app.  When both
+    have the DSA numbers, those decide the fingerprint, since GnuPG keeps
+    its own kind of fingerprint.  Returns how many of the keys in expected
+    came back, and a list of (name, field, expected, got) for every value
+    that came back different.
+    '''
+    kept = 0
+    conflicts = []
+    for name, key in sorted(expected.items()):
+        if name not in got:
+            continue
+        kept += 1
+        other = got[name]
+        for field in KEY_FIELDS:
+            if field in key and field in other and key[field] != other[field]:
+                conflicts.append((name, field, str(key[field]), str(other[field])))
+        if 'fingerprint' in key and 'fingerprint' in other \
+                and not ('y' in key and 'y' in other) \
+                and key['fingerprint'].lower() != other['fingerprint'].lower():
+            conflicts.append((name, 'fingerprint', key['fingerprint'], other['fingerprint']))
+        if 'verification' in key and 'verification' in other \
+                and _verified(key) != _verified(other):
+            conflicts.append((name, 'verification', str(_verified(key)), str(_verified(other))))
+    return kept, conflicts
+
+
+def _init_worker():
+    # the parsers and writers are chatty
+    sys.stdout = open(os.devnull, 'w')
+
+
+def run_pair(job):
+    '''read inapp's profile, write it as outapp, then read that back in'''
+    inapp, outapp, sourcedir, workdir = job
+    result = {'input': inapp, 'output': outapp}
+    outdir = os.path.join(workdir, inapp + '-to-' + outapp)
+    try:
+        start = time.time()
+        source = synthetic.parse_profile(inapp, sourcedir)
+        read_s = time.time() - start
+        synthetic.prepare_profile(outapp, source, outdir)
+        start = time.time()
+        synthetic.write_profile(outapp, source, outdir)
+        write_s = time.time() - start
+        start = time.time()
+        back = synthetic.parse_profile(outapp, outdir)
+        reread_s = time.time() - start
+    except Exception as e:
+        result['error'] = '%s: %s' % (e.__class__.__name__, e)
+        return result
+    finally:
+        shutil.rmtree(outdir, ignore_errors=True)
+    kept, conflicts = compare(source, back)
+    total_s = read_s + write_s + reread_s
+    result.update({'keys': len(source),
+                   'kept': kept,
+                   'conflicts': conflicts,
+                   'read_s': read_s,
+                   'write_s': write_s,
+                   'reread_s': reread_s,
+                   'keys_per_s': len(source) / total_s if total_s > 0 else None})
+    return result
+
+
+def run(readers, writers, accounts, buddies, fingerprints, jobs, workdir):
+    '''make a synthetic profile for each reader, then run every pair'''
+    keydict = synthetic.make_keydict(accounts, buddies)
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        for app in readers:
+            synthetic.make_profile(app, keydict, os.path.join(workdir, 'source', app),
+                                   fingerprints)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    pairs = [(inapp, outapp, os.path.join(workdir, 'source', inapp), workdir)
+             for inapp in readers for outapp in writers]
+    if jobs == 1:
+        _init_worker()
+        try:
+            return [run_pair(pair) for pair in pairs]
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+    pool = multiprocessing.Pool(jobs, _init_worker)
+    try:
+        return pool.map(run_pair, pairs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def regressions(results, baseline, tolerance):
+    '''list what got worse than the baseline: errors, conflicts, lost keys, speed'''
+    old = dict(((r['input'], r['output']), r) for r in baseline)
+    found = []
+    for r in results:
+        b = old.get((r['input'], r['output']))
+        if b is None:
+            continue
+        pair = r['input'] + '->' + r['output']
+        if 'error' in r and 'error' not in b:
+            found.append((pair, 'error', '', r['error']))
+            continue
+        if 'error' in r or 'error' in b:
+            continue
+        if len(r['conflicts']) > len(b['conflicts']):
+            found.append((pair, 'conflicts', len(b['conflicts']), len(r['conflicts'])))
+        if r['kept'] < b['kept']:
+            found.append((pair, 'kept', b['kept'], r['kept']))
+        if r['keys_per_s'] and b['keys_per_s'] \
+                and r['keys_per_s'] < b['keys_per_s'] / (1 + tolerance):
+            found.append((pair, 'keys_per_s', int(b['keys_per_s']), int(r['keys_per_s'])))
+    return found
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--accounts', type=int, default=3,
+                        help='accounts with private keys (default: 3)')
+    parser.add_argument('--buddies', type=int, default=50,
+                        help='buddies with fingerprints (default: 50)')
+    parser.add_argument('--fingerprints', type=int, default=1,
+                        help='fingerprints per buddy in libotr files (default: 1)')
+    parser.add_argument('-i', '--input', action='append', choices=READERS,
+                        help='only read this app, can be given more than once')
+    parser.add_argument('-o', '--output', action='append', choices=WRITERS,
+                        help='only write this app, can be given more than once')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+                        help='pairs to run at once, use 1 for steadier timings (default: %(default)s)')
+    parser.add_argument('--report', metavar='FILE', default='roundtrip-results.json',
+                        help='write the results as JSON to FILE (default: roundtrip-results.json)')
+    parser.add_argument('--baseline', metavar='FILE', default=None,
+                        help='compare the speed against the results in FILE'
+                        ' (default: roundtrip-baseline.json, if it exists)')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='flag pairs this much slower than the baseline (default: 0.5)')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False,
+                        help='list every conflict')
+    args = parser.parse_args(argv)
+
+    readers = args.input or READERS
+    writers = args.output or WRITERS
+    workdir = tempfile.mkdtemp(prefix='.keysync-roundtrip-')
+    try:
+        start = time.time()
+        results = run(readers, writers, args.accounts, args.buddies, args.fingerprints,
+                      args.jobs, workdir)
+        elapsed = time.time() - start
+    finally:
+        shutil.rmtree(workdir)
+
+    print('%-22s %6s %6s %9s %10s' % ('', 'keys', 'kept', 'conflicts', 'keys/s'))
+    failed = 0
+    for r in results:
+        pair = r['input'] + ' -> ' + r['output']
+        if 'error' in r:
+            failed += 1
+            print('%-22s %s' % (pair, r['error']))
+            continue
+        if r['conflicts']:
+            failed += 1
+        print('%-22s %6d %6d %9d %10.0f' % (pair, r['keys'], r['kept'], len(r['conflicts']),
+                                            r['keys_per_s'] or 0))
+        if args.verbose:
+            for name, field, old, new in r['conflicts']:
+                print('    %s %s: %s -> %s' % (name, field, old[:40], new[:40]))
+    print('%d pairs, %d with errors or conflicts, in %.2fs with %d jobs'
+          % (len(results), failed, elapsed, args.jobs))
+
+    report = {'python': sys.version.split()[0],
+              'accounts': args.accounts,
+              'buddies': args.buddies,
+              'fingerprints': args.fingerprints,
+              'jobs': args.jobs,
+              'results': results}
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print('wrote ' + args.report)
+
+    # every pair should come back whole, baseline or not
+    if failed:
+        print('ERROR: %d pairs have errors or conflicts!' % failed)
+
+    baselinefile = args.baseline or DEFAULT_BASELINE
+    if os.path.exists(baselinefile):
+        with open(baselinefile) as f:
+            baseline = json.load(f)
+        for setting in ('accounts', 'buddies', 'fingerprints', 'jobs'):
+            if baseline.get(setting) != report[setting]:
+                print('WARNING: baseline was run with %s=%s' % (setting, baseline.get(setting)))
+        found = regressions(results, baseline['results'], args.tolerance)
+        for pair, metric, old, new in found:
+            print('REGRESSION %s %s: %s -> %s' % (pair, metric, old, new))
+        if found:
+            sys.exit(1)
+        print('no regressions against ' + baselinefile)
+    elif args.baseline:
+        print('ERROR: there is no baseline "' + args.baseline + '" to compare against!')
+        sys.exit(1)
+    else:
+        # the speeds depend on the machine, so each one needs its own
+        print('WARNING: the speeds were not checked, there is no baseline yet.  Make one')
+        print('on this machine from a known good run with:')
+        print('    cp ' + args.report + ' ' + DEFAULT_BASELINE)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
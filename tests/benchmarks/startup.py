@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+measure how long keysync takes to start up in a fresh interpreter, and
+which imports that time goes to, and check both against a budget file.
+
+The budget file is JSON.  "modules" maps the name of a module to its most
+allowed cumulative import time in ms, i.e. including everything it
+imports, so 0 means it should not be imported at all.  The "*" entry is
+the most that any other module can take on its own, not counting what it
+imports.  "scenarios" maps the name of each scenario to its most allowed
+"median_ms", and "modules" that replace the ones for every scenario.
+'''
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+projectbase = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+testbase = os.path.join(projectbase, 'tests')
+keysync = os.path.join(projectbase, 'keysync')
+keysync_gui = os.path.join(projectbase, 'keysync-gui')
+
+DEFAULT_BUDGET = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'startup-budget.json')
+
+ALL_APP_MODULES = ['otrapps.' + app for app in
+                   ('adium', 'chatsecure', 'irssi', 'jitsi', 'pidgin', 'gajim',
+                    'gnupg', 'xchat', 'kopete')]
+
+# set up the GUI without running its main loop, and without a display only
+# load it, which is most of the work.  keysync-gui has no .py to import by.
+GUI_INIT = '''
+import os, runpy, sys
+gui = runpy.run_path(%r, run_name='keysync_gui')
+if os.environ.get('DISPLAY') or sys.platform in ('darwin', 'win32'):
+    app = gui['App']()
+    app.update()
+    app.destroy()
+''' % keysync_gui
+
+# -X importtime is only in python 3.7 and newer, this prints the same lines
+# for older pythons by timing every import of a module not yet loaded
+IMPORT_TIMER = '''
+import runpy, sys, time
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+_import = builtins.__import__
+_children = [0.0]
+def _timed_import(name, *args, **kwargs):
+    if name in sys.modules or (len(args) > 3 and args[3]):
+        return _import(name, *args, **kwargs)
+    _children.append(0.0)
+    start = time.time()
+    try:
+        return _import(name, *args, **kwargs)
+    finally:
+        total = time.time() - start
+        children = _children.pop()
+        _children[-1] += total
+        sys.stderr.write('import time: %10d | %10d | %s\\n'
+                         % ((total - children) * 1e6, total * 1e6, name))
+builtins.__import__ = _timed_import
+sys.argv = sys.argv[1:]
+if sys.argv[0] == '-c':
+    sys.argv = sys.argv[1:]
+    exec(compile(sys.argv[0], '<string>', 'exec'), {'__name__': '__main__'})
+else:
+    sys.path.insert(0, __import__('os').path.dirname(sys.argv[0]))
+    runpy.run_path(sys.argv[0], run_name='__main__')
+'''
+
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (.*)$')
+
+
+def get_scenarios(outdir):
+    '''each scenario is a name and the arguments to python to time'''
+    return [
+        ('import otrapps',
+         ['-c', 'import otrapps']),
+        ('import every app module',
+         ['-c', 'import ' + ', '.join(ALL_APP_MODULES)]),
+        ('keysync --version',
+         [keysync, '--version']),
+        ('keysync -i pidgin -o irssi',
+         [keysync, '--test', testbase, '-i', 'pidgin', '-o', 'irssi',
+          '--output-folder', outdir]),
+        ('keysync-gui init',
+         ['-c', GUI_INIT]),
+    ]
+
+
+def _env():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = projectbase
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+    return env
+
+
+def time_command(args, repeat):
+    '''run python with args repeat times in fresh processes, return the wall times'''
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for i in range(repeat):
+            start = time.time()
+            subprocess.check_call([sys.executable] + args, cwd=projectbase, env=_env(),
+                                  stdout=devnull, stderr=devnull)
+            times.append(time.time() - start)
+    return times
+
+
+def import_times(args):
+    '''
+    Run python with args once more, with every import timed, and return
+    {module: (self ms, cumulative ms)}.
+    '''
+    if sys.version_info >= (3, 7):
+        cmd = [sys.executable, '-X', 'importtime'] + args
+    else:
+        cmd = [sys.executable, '-c', IMPORT_TIMER] + args
+    with open(os.devnull, 'w') as devnull:
+        p = subprocess.Popen(cmd, cwd=projectbase, env=_env(),
+                             stdout=devnull, stderr=subprocess.PIPE)
+        stderr = p.communicate()[1]
+    modules = dict()
+    for line in stderr.decode('utf-8', 'replace').splitlines():
+        m = IMPORT_TIME_LINE.match(line)
+        if m:
+            name = m.group(3).strip()
+            own, cumulative = modules.get(name, (0.0, 0.0))
+            modules[name] = (own + int(m.group(1)) / 1000.0,
+                             cumulative + int(m.group(2)) / 1000.0)
+    return modules
+
+
+def check_budget(results, budget):
+    '''list (scenario, what, budget ms, measured ms) for everything over budget'''
+    over = []
+    for result in results:
+        name = result['scenario']
+        scenario = budget.get('scenarios', dict()).get(name, dict())
+        if 'median_ms' in scenario and result['median_ms'] > scenario['median_ms']:
+            over.append((name, 'median', scenario['median_ms'], result['median_ms']))
+        modules = dict(budget.get('modules', dict()))
+        modules.update(scenario.get('modules', dict()))
+        default = modules.get('*')
+        for module, (own, cumulative) in sorted(result['imports'].items()):
+            if module in modules:
+                if cumulative > modules[module] or modules[module] == 0:
+                    over.append((name, 'import ' + module, modules[module], cumulative))
+            elif default is not None and own > default:
+                over.append((name, 'import ' + module + ' (self)', default, own))
+    return over
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--repeat', type=int, default=5,
+                        help='how many times to run each scenario (default: 5)')
+    parser.add_argument('--json', metavar='FILE', default=None,
+                        help='also write the results to FILE as JSON')
+    parser.add_argument('--budget', metavar='FILE', default=None,
+                        help='check against the budget in FILE (default: startup-budget.json)')
+    parser.add_argument('--top', type=int, default=5,
+                        help='show this many of the slowest imports per scenario (default: 5)')
+    args = parser.parse_args(argv)
+
+    outdir = tempfile.mkdtemp(prefix='.keysync-startup-')
+    results = []
+    try:
+        for name, cmd in get_scenarios(outdir):
+            try:
+                times = sorted(time_command(cmd, args.repeat))
+            except subprocess.CalledProcessError as e:
+                # i.e. keysync-gui without Tk or PIL installed
+                print('%-32s skipped, it exited with %d' % (name, e.returncode))
+                continue
+            result = {'scenario': name,
+                      'min_ms': times[0] * 1000,
+                      'median_ms': times[len(times) // 2] * 1000,
+                      'runs': len(times),
+                      'imports': import_times(cmd)}
+            results.append(result)
+            print('%-32s min %8.1f ms   median %8.1f ms'
+                  % (name, result['min_ms'], result['median_ms']))
+            slowest = sorted(result['imports'].items(), key=lambda i: -i[1][0])
+            for module, (own, cumulative) in slowest[:args.top]:
+                print('    %-40s self %7.1f ms   cumulative %7.1f ms' % (module, own, cumulative))
+    finally:
+        shutil.rmtree(outdir)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'results': results},
+                      f, indent=2, sort_keys=True)
+
+    budgetfile = args.budget or DEFAULT_BUDGET
+    if not os.path.exists(budgetfile):
+        if args.budget:
+            print('ERROR: there is no budget "' + args.budget + '" to check against!')
+            sys.exit(1)
+        print('\n' + '#' * 72)
+        print('WARNING: NOT CHECKED AGAINST A BUDGET, ' + DEFAULT_BUDGET + ' is missing!')
+        print('#' * 72)
+        return
+    with open(budgetfile) as f:
+        budget = json.load(f)
+    over = check_budget(results, budget)
+    for name, what, allowed, measured in over:
+        print('OVER BUDGET %s: %s took %.1f ms, the budget is %.1f ms'
+              % (name, what, measured, allowed))
+    if over:
+        sys.exit(1)
+    print('everything is within ' + budgetfile)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''generate synthetic OTR profiles of any size for every supported app'''
+
+from __future__ import print_function
+import copy
+import hashlib
+import os
+import plistlib
+import random
+import struct
+import sys
+import time
+
+projectbase = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, projectbase)
+import otrapps
+import otrapps.util
+from otrapps.otr_private_key import OtrPrivateKeys
+
+ACCOUNT_DOMAIN = 'example.com'
+BUDDY_DOMAIN = 'example.net'
+RESOURCE = 'keysync'
+
+
+def _dsa_params():
+    '''borrow real DSA domain parameters from the test fixtures'''
+    keydict = OtrPrivateKeys.parse(os.path.join(projectbase, 'tests', 'pidgin',
+                                                'otr.private_key'))
+    key = list(keydict.values())[0]
+    return key['p'], key['q'], key['g']
+
+
+def account_name(i):
+    return 'account%d@%s' % (i, ACCOUNT_DOMAIN)
+
+
+def buddy_name(i):
+    return 'buddy%d@%s' % (i, BUDDY_DOMAIN)
+
+
+def make_keydict(accounts, buddies, seed=0):
+    '''
+    A keydict with a private key for each account, and a fingerprint for
+    each buddy, every other one of which is verified.  The keys are real
+    DSA keys made from fixed domain parameters, so they are quick to make.
+    '''
+    rng = random.Random(seed)
+    p, q, g = _dsa_params()
+    keydict = dict()
+    for i in range(accounts):
+        x = rng.randrange(2, q - 1)
+        key = {'name': account_name(i), 'protocol': 'prpl-jabber',
+               'resource': RESOURCE, 'type': 'dsa',
+               'p': p, 'q': q, 'g': g, 'x': x, 'y': pow(g, x, p)}
+        key['fingerprint'] = otrapps.util.fingerprint((key['y'], g, p, q))
+        keydict[key['name']] = key
+    for i in range(buddies):
+        key = {'name': buddy_name(i), 'protocol': 'prpl-jabber',
+               'fingerprint': '%040x' % rng.getrandbits(160)}
+        if i % 2 == 0:
+            key['verification'] = 'verified'
+        else:
+            key['verification'] = ''
+        keydict[key['name']] = key
+    return keydict
+
+
+def _accounts(keydict):
+    return sorted(name for name, key in keydict.items() if 'x' in key)
+
+
+def _buddies(keydict):
+    return sorted(name for name, key in keydict.items() if 'x' not in key)
+
+
+def _write_pidgin_accounts(keydict, profiledir):
+    with open(os.path.join(profiledir, 'accounts.xml'), 'w') as f:
+        f.write("<?xml version='1.0' encoding='UTF-8' ?>\n\n<account version='1.0'>\n")
+        for name in _accounts(keydict):
+            f.write('\t<account>\n\t\t<protocol>prpl-jabber</protocol>\n'
+                    '\t\t<name>%s/%s</name>\n\t</account>\n' % (name, RESOURCE))
+        f.write('</account>\n')
+
+
+def _write_adium_accounts(keydict, profiledir):
+    accounts = []
+    for i, name in enumerate(_accounts(keydict)):
+        accounts.append({'ObjectID': str(i + 1), 'Service': 'Jabber',
+                         'Type': 'libpurple-Jabber', 'UID': name})
+    plist = {'Accounts': accounts}
+    filename = os.path.join(profiledir, 'Accounts.plist')
+    if hasattr(plistlib, 'dump'):
+        with open(filename, 'wb') as f:
+            plistlib.dump(plist, f)
+    else:
+        plistlib.writePlist(plist, filename)
+
+
+def _write_gajim_accounts(keydict, profiledir):
+    with open(os.path.join(profiledir, 'config'), 'w') as f:
+        for i, name in enumerate(_accounts(keydict)):
+            user, host = name.split('@')
+            f.write('accounts.acct%d.name = %s\n' % (i, user))
+            f.write('accounts.acct%d.hostname = %s\n' % (i, host))
+            f.write('accounts.acct%d.resource = %s\n' % (i, RESOURCE))
+
+
+def _write_jitsi_accounts(keydict, profiledir):
+    accounts = _accounts(keydict)
+    with open(os.path.join(profiledir, 'sip-communicator.properties'), 'w') as f:
+        for i, name in enumerate(accounts):
+            f.write('net.java.sip.communicator.impl.protocol.jabber.acc%d.ACCOUNT_UID=Jabber\\:%s@%s\n'
+                    % (i, name, name.split('@')[1]))
+    if accounts:
+        account_id = 'Jabber:%s@%s' % (accounts[0], accounts[0].split('@')[1])
+    else:
+        account_id = 'Jabber:nobody@' + ACCOUNT_DOMAIN
+    with open(os.path.join(profiledir, 'contactlist.xml'), 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n<sip-communicator>\n')
+        f.write('<group name="RootMetaContactGroup" uid="RootMetaContactGroup"><child-contacts>\n')
+        for i, name in enumerate(_buddies(keydict)):
+            f.write('<meta-contact uid="%d"><display-name>%s</display-name>'
+                    '<contact account-id="%s" address="%s"/></meta-contact>\n'
+                    % (i, name, account_id, name))
+        f.write('</child-contacts></group>\n</sip-communicator>\n')
+
+
+def _mpi(n):
+    '''an OpenPGP multi-precision integer'''
+    data = bytearray()
+    while n > 0:
+        data.insert(0, n & 0xff)
+        n >>= 8
+    bits = (len(data) - 1) * 8 + len(bin(data[0])) - 2 if data else 0
+    return bytearray(struct.pack('>H', bits)) + data
+
+
+def _packet(tag, body):
+    '''an old format OpenPGP packet with a two byte length'''
+    return bytearray(struct.pack('>BH', 0x80 | (tag << 2) | 1, len(body))) + body
+
+
+def write_gnupg_secring(keydict, profiledir):
+    '''GnuPG cannot be written by keysync, so make a secring.gpg by hand'''
+    secring = bytearray()
+    created = int(time.time())
+    for name in _accounts(keydict):
+        key = keydict[name]
+        secring += _packet(13, bytearray(('Synthetic User <' + name + '>').encode('utf-8')))
+        body = bytearray(struct.pack('>BIB', 4, created, 17))
+        for num in ('p', 'q', 'g', 'y'):
+            body += _mpi(key[num])
+        x = _mpi(key['x'])
+        body += bytearray([0]) + x + bytearray(struct.pack('>H', sum(x) % 65536))
+        secring += _packet(7, body)
+    with open(os.path.join(profiledir, 'secring.gpg'), 'wb') as f:
+        f.write(secring)
+
+
+def prepare_profile(app, keydict, profiledir):
+    '''write the account files that an app's writer needs to find'''
+    if not os.path.exists(profiledir):
+        os.makedirs(profiledir)
+    if app == 'pidgin':
+        _write_pidgin_accounts(keydict, profiledir)
+    elif app == 'adium':
+        _write_adium_accounts(keydict, profiledir)
+    elif app == 'gajim':
+        _write_gajim_accounts(keydict, profiledir)
+    elif app == 'jitsi':
+        _write_jitsi_accounts(keydict, profiledir)
+
+
+def write_profile(app, keydict, profiledir):
+    '''write keydict into profiledir in app's format using keysync's writer'''
+    if app == 'gnupg':
+        write_gnupg_secring(keydict, profiledir)
+        return
+    properties = otrapps.apps[app]
+    # some writers translate names and protocols in place
+    properties.write(copy.deepcopy(keydict), profiledir)
+    if app == 'chatsecure':
+        # the parser reads the decrypted keystore
+        keyfile = properties._decrypt_ofcaes(
+            os.path.join(profiledir, properties.encryptedkeyfile), properties.password)
+        os.rename(keyfile, os.path.join(profiledir, properties.keyfile))
+
+
+def add_fingerprints(app, profiledir, fingerprints):
+    '''
+    Add extra fingerprints per buddy to the libotr-style fingerprint files,
+    like a buddy who uses OTR from more than one device.
+    '''
+    if fingerprints <= 1:
+        return
+    names = {'pidgin': ['otr.fingerprints'], 'adium': ['otr.fingerprints'],
+             'irssi': ['otr.fp'], 'xchat': ['otr.fp'], 'kopete': ['fingerprints']}
+    if app == 'gajim':
+        filenames = [f for f in os.listdir(profiledir) if f.endswith('.fpr')]
+    else:
+        filenames = names.get(app, [])
+    for filename in filenames:
+        path = os.path.join(profiledir, filename)
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            rows = [line.rstrip('\r\n').split('\t') for line in f if line.strip()]
+        with open(path, 'w') as f:
+            for row in rows:
+                f.write('\t'.join(row) + '\n')
+                if not row[0].endswith('@' + BUDDY_DOMAIN):
+                    continue
+                for i in range(1, fingerprints):
+                    # the same extra fingerprints in every file
+                    extra = list(row)
+                    extra[3] = hashlib.sha1((row[0] + str(i)).encode('utf-8')).hexdigest()
+                    f.write('\t'.join(extra) + '\n')
+
+
+def parse_profile(app, profiledir):
+    '''read a profile back in with keysync's parser'''
+    properties = otrapps.apps[app]
+    if app == 'chatsecure':
+        return properties.parse(os.path.join(profiledir, properties.keyfile))
+    return properties.parse(profiledir)
+
+
+def make_profile(app, keydict, profiledir, fingerprints=1):
+    '''generate a complete synthetic profile for app in profiledir'''
+    prepare_profile(app, keydict, profiledir)
+    write_profile(app, keydict, profiledir)
+    add_fingerprints(app, profiledir, fingerprints)
+
+
+#------------------------------------------------------------------------------#
+# for testing from the command line:
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('outdir', help='make one subfolder per app in this folder')
+    parser.add_argument('--accounts', type=int, default=3)
+    parser.add_argument('--buddies', type=int, default=20)
+    parser.add_argument('--fingerprints', type=int, default=1,
+                        help='fingerprints per buddy')
+    parser.add_argument('-a', '--app', action='append', choices=sorted(otrapps.apps_supported))
+    args = parser.parse_args(argv)
+
+    keydict = make_keydict(args.accounts, args.buddies)
+    for app in args.app or sorted(otrapps.apps_supported):
+        profiledir = os.path.join(args.outdir, app)
+        make_profile(app, keydict, profiledir, args.fingerprints)
+        print(app + ': ' + profiledir)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
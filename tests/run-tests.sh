@@ -62,7 +62,7 @@ echo '========================================================================'
 echo "Run each python file's __main__ tests"
 echo '========================================================================'
 cd $projectbase/otrapps
-for app in adium chatsecure gajim gnupg irssi jitsi kopete pidgin xchat util; do
+for app in adium chatsecure gajim gnupg irssi jitsi kopete otr_fingerprints pidgin pipeline plist xchat util; do
     echo ''
     echo ''
     echo '------------------------------------------------------------------------'
@@ -108,6 +108,102 @@ for inapp in adium chatsecure gajim gnupg irssi jitsi kopete pidgin xchat; do
 done
 
 
+echo '========================================================================'
+echo "Convert each app to irssi with keysync batch"
+echo '========================================================================'
+cd $projectbase
+manifest=$tmpdir/batch-manifest.json
+echo '[' > $manifest
+for inapp in adium gajim gnupg irssi jitsi kopete pidgin; do
+    echo "{\"input_root\": \"$testbase\", \"input\": \"$inapp\", \"output\": \"irssi\"," \
+        "\"output_folder\": \"$tmpdir/batch-$inapp\"}," >> $manifest
+done
+echo "{\"input_root\": \"$testbase\", \"input\": \"xchat\", \"output\": \"irssi\"," \
+    "\"output_folder\": \"$tmpdir/batch-xchat\"}]" >> $manifest
+$keysync batch $manifest --report $tmpdir/batch-report.json
+
+
+echo '========================================================================'
+echo "Send list, convert and merge requests to keysync serve"
+echo '========================================================================'
+if which curl > /dev/null; then
+    cd $projectbase
+    socket=$tmpdir/keysync.sock
+    $keysync serve --socket $socket &
+    serve_pid=$!
+    for i in 1 2 3 4 5 6 7 8 9 10; do
+        test -S $socket && break
+        sleep 1
+    done
+    request="{\"input_root\": \"$testbase\", \"input\": [\"pidgin\", \"adium\"]}"
+    curl -sf --unix-socket $socket -H "Content-Type: application/json" -d "$request" http://localhost/list
+    request="{\"input_root\": \"$testbase\", \"input\": \"jitsi\", \"output\": \"xchat\","
+    request="$request \"output_folder\": \"$tmpdir/serve-convert\"}"
+    curl -sf --unix-socket $socket -H "Content-Type: application/json" -d "$request" http://localhost/convert
+    request="{\"sources\": [{\"input_root\": \"$testbase\", \"input\": \"irssi\"},"
+    request="$request {\"input_root\": \"$testbase\", \"input\": \"xchat\"}],"
+    request="$request \"output\": \"irssi\", \"output_folder\": \"$tmpdir/serve-merge\"}"
+    curl -sf --unix-socket $socket -H "Content-Type: application/json" -d "$request" http://localhost/merge
+    kill $serve_pid
+else
+    echo 'curl not found, skipping'
+fi
+
+
+echo '========================================================================'
+echo "Stream all test files into the libotr apps and gajim"
+echo '========================================================================'
+cd $projectbase
+outdir=$tmpdir/stream
+mkdir $outdir
+copy_accounts_files gajim $testbase $outdir
+copy_accounts_files pidgin $testbase $outdir
+$keysync --stream --test $testbase \
+    -i adium -i gnupg -i irssi -i jitsi -i pidgin -i xchat \
+    -o irssi -o pidgin -o gajim \
+    --output-folder $outdir
+
+# hans@eds.org has several fingerprints, which must be merged the same
+# when streamed, for the outputs that get the merged keys
+for mode in stream merged; do
+    copy_accounts_files pidgin $testbase $tmpdir/stream-$mode
+    copy_accounts_files jitsi $testbase $tmpdir/stream-$mode
+done
+$keysync --stream --test $testbase -i pidgin -o pidgin -o jitsi \
+    --output-folder $tmpdir/stream-stream > $tmpdir/stream-stream.log
+$keysync --test $testbase -i pidgin -o pidgin -o jitsi --no-qrcode \
+    --output-folder $tmpdir/stream-merged > $tmpdir/stream-merged.log
+# the first line is the time it was written
+for mode in stream merged; do
+    grep -v '^#' $tmpdir/stream-$mode/sip-communicator.properties > $tmpdir/stream-$mode.properties
+done
+diff $tmpdir/stream-stream.properties $tmpdir/stream-merged.properties
+if grep 'did not match' $tmpdir/stream-stream.log; then
+    echo '--stream found conflicts that the normal merge does not'
+    exit 1
+fi
+
+
+echo '========================================================================'
+echo "Convert synthetic keys from each app to each other app and back"
+echo '========================================================================'
+cd $projectbase/tests/benchmarks
+# not the default size, so that no pair passes only by chance
+python ./roundtrip.py --buddies 10 --report $tmpdir/roundtrip.json
+
+
+echo '========================================================================'
+echo "Generate keys for the accounts that do not have one"
+echo '========================================================================'
+cd $projectbase
+outdir=$tmpdir/generate
+mkdir $outdir
+copy_accounts_files gajim $testbase $outdir
+copy_accounts_files pidgin $testbase $outdir
+$keysync generate --test $testbase -i gajim -i pidgin -o gajim -o pidgin \
+    --output-folder $outdir
+
+
 echo '========================================================================'
 echo "decrypt ChatSecure file to all apps"
 echo '========================================================================'